@@ -0,0 +1,41 @@
+"""Create videos table
+
+Revision ID: 1d6f0c8a5e27
+Revises: 
+Create Date: 2026-10-17 18:40:12.306518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1d6f0c8a5e27'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The table as it was before the first migration; later revisions add the rest
+    op.create_table(
+        'videos',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('video_id', sa.String(length=100), nullable=False),
+        sa.Column('s3_url', sa.String(length=500), nullable=False),
+        sa.Column('duration', sa.Float(), nullable=False),
+        sa.Column('tags', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_videos_id'), 'videos', ['id'], unique=False)
+    op.create_index(op.f('ix_videos_video_id'), 'videos', ['video_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_videos_video_id'), table_name='videos')
+    op.drop_index(op.f('ix_videos_id'), table_name='videos')
+    op.drop_table('videos')
@@ -1,7 +1,7 @@
 """Add explicit content and transcription fields
 
 Revision ID: 3af201c3c131
-Revises: 
+Revises: 1d6f0c8a5e27
 Create Date: 2025-03-20 23:19:04.743314
 
 """
@@ -13,7 +13,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision: str = '3af201c3c131'
-down_revision: Union[str, None] = None
+down_revision: Union[str, None] = '1d6f0c8a5e27'
 branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
@@ -0,0 +1,45 @@
+"""Add annotation results table and analysis job features
+
+Revision ID: 4f1a8d7b2c90
+Revises: 9e4b6c1a0f52
+Create Date: 2026-10-17 15:42:18.304117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f1a8d7b2c90'
+down_revision: Union[str, None] = '9e4b6c1a0f52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'annotation_results',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('video_id', sa.String(length=100), nullable=False),
+        sa.Column('content_hash', sa.String(length=100), nullable=False),
+        sa.Column('feature', sa.String(length=50), nullable=False),
+        sa.Column('result', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_annotation_results_id'), 'annotation_results', ['id'], unique=False)
+    op.create_index('ix_annotation_results_lookup', 'annotation_results', ['video_id', 'content_hash', 'feature'], unique=True)
+    op.add_column('analysis_jobs', sa.Column('features', sa.JSON(), nullable=True))
+    op.add_column('analysis_jobs', sa.Column('force', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('analysis_jobs', 'force')
+    op.drop_column('analysis_jobs', 'features')
+    op.drop_index('ix_annotation_results_lookup', table_name='annotation_results')
+    op.drop_index(op.f('ix_annotation_results_id'), table_name='annotation_results')
+    op.drop_table('annotation_results')
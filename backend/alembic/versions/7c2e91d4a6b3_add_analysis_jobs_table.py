@@ -0,0 +1,58 @@
+"""Add analysis jobs table
+
+Revision ID: 7c2e91d4a6b3
+Revises: b11113d926dd
+Create Date: 2026-10-17 09:12:41.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e91d4a6b3'
+down_revision: Union[str, None] = 'b11113d926dd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'analysis_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.String(length=100), nullable=False),
+        sa.Column('video_id', sa.String(length=100), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('progress', sa.String(length=50), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_analysis_jobs_id'), 'analysis_jobs', ['id'], unique=False)
+    op.create_index(op.f('ix_analysis_jobs_job_id'), 'analysis_jobs', ['job_id'], unique=True)
+    op.create_index(op.f('ix_analysis_jobs_video_id'), 'analysis_jobs', ['video_id'], unique=False)
+    op.create_index(op.f('ix_analysis_jobs_status'), 'analysis_jobs', ['status'], unique=False)
+    op.create_index(op.f('ix_analysis_jobs_next_attempt_at'), 'analysis_jobs', ['next_attempt_at'], unique=False)
+    op.create_index(
+        'ix_analysis_jobs_active_video_id', 'analysis_jobs', ['video_id'], unique=True,
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+        sqlite_where=sa.text("status IN ('queued', 'running')"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_analysis_jobs_active_video_id', table_name='analysis_jobs')
+    op.drop_index(op.f('ix_analysis_jobs_next_attempt_at'), table_name='analysis_jobs')
+    op.drop_index(op.f('ix_analysis_jobs_status'), table_name='analysis_jobs')
+    op.drop_index(op.f('ix_analysis_jobs_video_id'), table_name='analysis_jobs')
+    op.drop_index(op.f('ix_analysis_jobs_job_id'), table_name='analysis_jobs')
+    op.drop_index(op.f('ix_analysis_jobs_id'), table_name='analysis_jobs')
+    op.drop_table('analysis_jobs')
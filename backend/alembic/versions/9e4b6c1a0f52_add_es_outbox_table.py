@@ -0,0 +1,35 @@
+"""Add Elasticsearch outbox table
+
+Revision ID: 9e4b6c1a0f52
+Revises: d58a3f0c27e1
+Create Date: 2026-10-17 13:05:52.871430
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b6c1a0f52'
+down_revision: Union[str, None] = 'd58a3f0c27e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'es_outbox',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('video_id', sa.String(length=100), nullable=False),
+        sa.Column('document', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('es_outbox')
@@ -0,0 +1,37 @@
+"""Add SNS inbox table
+
+Revision ID: a6e1d3f8b274
+Revises: f2c7a4e8d913
+Create Date: 2026-10-18 11:42:19.305127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6e1d3f8b274'
+down_revision: Union[str, None] = 'f2c7a4e8d913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'sns_inbox',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('message_id', sa.String(length=100), nullable=True),
+        sa.Column('notification', sa.JSON(), nullable=False),
+        sa.Column('received_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_sns_inbox_message_id'), 'sns_inbox', ['message_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_sns_inbox_message_id'), table_name='sns_inbox')
+    op.drop_table('sns_inbox')
@@ -0,0 +1,31 @@
+"""Add video content hash
+
+Revision ID: b7d3e9f12a48
+Revises: 4f1a8d7b2c90
+Create Date: 2026-10-17 16:20:41.552903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d3e9f12a48'
+down_revision: Union[str, None] = '4f1a8d7b2c90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing rows keep a NULL hash; only new uploads through /upload are hashed
+    op.add_column('videos', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_videos_content_hash'), 'videos', ['content_hash'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_videos_content_hash'), table_name='videos')
+    op.drop_column('videos', 'content_hash')
@@ -0,0 +1,28 @@
+"""Add upload_pending field to videos
+
+Revision ID: b9c4e2d7a153
+Revises: a6e1d3f8b274
+Create Date: 2026-10-18 15:08:37.426915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b9c4e2d7a153'
+down_revision: Union[str, None] = 'a6e1d3f8b274'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('videos', sa.Column('upload_pending', sa.Boolean(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('videos', 'upload_pending')
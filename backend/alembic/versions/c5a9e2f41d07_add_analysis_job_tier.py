@@ -0,0 +1,29 @@
+"""Add analysis job tier
+
+Revision ID: c5a9e2f41d07
+Revises: b7d3e9f12a48
+Create Date: 2026-10-17 18:05:12.417306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a9e2f41d07'
+down_revision: Union[str, None] = 'b7d3e9f12a48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing jobs keep a NULL tier and run with ANALYSIS_DEFAULT_TIER
+    op.add_column('analysis_jobs', sa.Column('tier', sa.String(length=10), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('analysis_jobs', 'tier')
@@ -0,0 +1,75 @@
+"""Add moderation summary fields
+
+Revision ID: d58a3f0c27e1
+Revises: 7c2e91d4a6b3
+Create Date: 2026-10-17 11:40:07.204391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd58a3f0c27e1'
+down_revision: Union[str, None] = '7c2e91d4a6b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same scale as main2.LIKELIHOOD_SEVERITY; older rows may hold the raw enum value instead of its name
+LIKELIHOOD_SEVERITY = {
+    "LIKELIHOOD_UNSPECIFIED": 0,
+    "VERY_UNLIKELY": 1,
+    "UNLIKELY": 2,
+    "POSSIBLE": 3,
+    "LIKELY": 4,
+    "VERY_LIKELY": 5,
+}
+
+
+def severity(likelihood) -> int:
+    if isinstance(likelihood, int):
+        return likelihood
+    return LIKELIHOOD_SEVERITY.get(likelihood, 0)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('videos', sa.Column('explicit_max_likelihood', sa.Integer(), nullable=True))
+    op.add_column('videos', sa.Column('explicit_flagged_frames', sa.Integer(), nullable=True))
+
+    # Backfill the summary for videos analyzed before this revision
+    videos = sa.table(
+        'videos',
+        sa.column('id', sa.Integer),
+        sa.column('explicit_content', sa.JSON),
+        sa.column('explicit_max_likelihood', sa.Integer),
+        sa.column('explicit_flagged_frames', sa.Integer),
+    )
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(videos.c.id, videos.c.explicit_content).where(videos.c.explicit_content.isnot(None)))
+    for video_id, explicit_content in rows.fetchall():
+        severities = [severity(frame.get("likelihood")) for frame in explicit_content or []]
+        connection.execute(
+            videos.update()
+            .where(videos.c.id == video_id)
+            .values(
+                explicit_max_likelihood=max(severities, default=0),
+                explicit_flagged_frames=sum(1 for value in severities if value >= LIKELIHOOD_SEVERITY["LIKELY"]),
+            )
+        )
+
+    op.create_index(
+        'ix_videos_moderation_queue', 'videos',
+        ['explicit_max_likelihood', 'explicit_flagged_frames', 'id'], unique=False,
+        postgresql_where=sa.text('explicit_content_detected = true'),
+        sqlite_where=sa.text('explicit_content_detected = 1'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_videos_moderation_queue', table_name='videos')
+    op.drop_column('videos', 'explicit_flagged_frames')
+    op.drop_column('videos', 'explicit_max_likelihood')
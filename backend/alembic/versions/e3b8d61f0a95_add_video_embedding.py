@@ -0,0 +1,29 @@
+"""Add video embedding
+
+Revision ID: e3b8d61f0a95
+Revises: c5a9e2f41d07
+Create Date: 2026-10-17 19:42:37.208114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3b8d61f0a95'
+down_revision: Union[str, None] = 'c5a9e2f41d07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Filled in by the next analysis of each video
+    op.add_column('videos', sa.Column('embedding', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('videos', 'embedding')
@@ -0,0 +1,49 @@
+"""Allow a queued follow-up analysis job next to a running one
+
+Revision ID: f2c7a4e8d913
+Revises: e3b8d61f0a95
+Create Date: 2026-10-18 09:27:45.613802
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c7a4e8d913'
+down_revision: Union[str, None] = 'e3b8d61f0a95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_index('ix_analysis_jobs_active_video_id', table_name='analysis_jobs')
+    op.create_index(
+        'ix_analysis_jobs_running_video_id', 'analysis_jobs', ['video_id'], unique=True,
+        postgresql_where=sa.text("status = 'running'"),
+        sqlite_where=sa.text("status = 'running'"),
+    )
+    op.create_index(
+        'ix_analysis_jobs_queued_video_id', 'analysis_jobs', ['video_id'], unique=True,
+        postgresql_where=sa.text("status = 'queued'"),
+        sqlite_where=sa.text("status = 'queued'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # A video with both a running and a queued job keeps only the running one
+    op.execute(
+        "UPDATE analysis_jobs SET status = 'failed', progress = 'superseded' "
+        "WHERE status = 'queued' AND video_id IN (SELECT video_id FROM analysis_jobs WHERE status = 'running')"
+    )
+    op.drop_index('ix_analysis_jobs_queued_video_id', table_name='analysis_jobs')
+    op.drop_index('ix_analysis_jobs_running_video_id', table_name='analysis_jobs')
+    op.create_index(
+        'ix_analysis_jobs_active_video_id', 'analysis_jobs', ['video_id'], unique=True,
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+        sqlite_where=sa.text("status IN ('queued', 'running')"),
+    )
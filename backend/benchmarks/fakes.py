@@ -0,0 +1,177 @@
+"""In-process stand-ins for Elasticsearch, Video Intelligence, Cloud Vision and Gemini.
+
+Each fake sleeps for a configurable latency and returns responses shaped like the real
+client's, so main2 runs its normal code paths. S3 is served by moto and the database is
+SQLite (or any local DATABASE_URL); see load.py.
+"""
+import asyncio
+import json
+import math
+import random
+from datetime import timedelta
+from types import SimpleNamespace
+
+from elasticsearch.serializer import JsonSerializer
+
+WORDS = [
+    "sunset", "beach", "city", "night", "music", "concert", "cooking", "recipe", "travel", "mountain",
+    "hiking", "dog", "cat", "football", "goal", "interview", "tutorial", "python", "guitar", "drone"
+]
+
+
+class BulkResponse(dict):
+    @property
+    def body(self):
+        return self
+
+
+class FakeIndices:
+    def __init__(self):
+        self.aliases = set()
+
+    async def exists_alias(self, name):
+        return name in self.aliases
+
+    async def exists(self, index):
+        return False
+
+    async def create(self, index, body):
+        self.aliases.update(body.get("aliases", {}))
+
+    async def put_mapping(self, index, body):
+        pass
+
+
+# Documents live in a dict; search scores by naive term counts, which is enough to exercise
+# the request path (search_after is ignored). kNN queries are answered by exact cosine similarity.
+# The bulk helpers serialize actions with the client's transport serializer, so that is real.
+class FakeElasticsearch:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.documents = {}
+        self.indices = FakeIndices()
+        serializer = JsonSerializer()
+        self.transport = SimpleNamespace(serializers=SimpleNamespace(get_serializer=lambda mimetype: serializer))
+
+    def options(self, **kwargs):
+        return self
+
+    async def bulk(self, operations, **kwargs):
+        await asyncio.sleep(self.latency)
+        lines = iter(json.loads(line) for line in operations)
+        items = []
+        for action in lines:
+            (op_type, meta), = action.items()
+            source = next(lines)
+            if op_type == "update":
+                self.documents.setdefault(meta["_id"], {}).update(source["doc"])
+            else:
+                self.documents[meta["_id"]] = source
+            items.append({op_type: {"_index": meta.get("_index"), "_id": meta["_id"], "status": 200}})
+        return BulkResponse(errors=False, items=items)
+
+    async def search(self, index, body):
+        await asyncio.sleep(self.latency)
+        if "knn" in body:
+            return self.knn(body["knn"])
+        terms = body["query"]["bool"]["must"]["multi_match"]["query"].lower().split()
+        hits = []
+        for video_id, document in self.documents.items():
+            text = " ".join(str(document.get(field) or "") for field in ("title", "description", "ai_generated_title", "transcription", "tags")).lower()
+            score = sum(text.count(term) for term in terms)
+            if score:
+                hits.append({"_id": video_id, "_score": float(score), "_source": document, "sort": [float(score), video_id]})
+        hits.sort(key=lambda hit: (-hit["_score"], hit["_id"]))
+        return {"hits": {"hits": hits[:body["size"]]}}
+
+    def knn(self, knn):
+        excluded = knn["filter"]["bool"]["must_not"]["term"]["video_id"]
+        query = knn["query_vector"]
+        query_norm = math.sqrt(sum(value * value for value in query))
+        hits = []
+        for video_id, document in self.documents.items():
+            vector = document.get("embedding")
+            if not vector or video_id == excluded:
+                continue
+            cosine = sum(a * b for a, b in zip(query, vector)) / (query_norm * math.sqrt(sum(value * value for value in vector)))
+            hits.append({"_id": video_id, "_score": (1 + cosine) / 2, "_source": document})
+        hits.sort(key=lambda hit: -hit["_score"])
+        return {"hits": {"hits": hits[:knn["k"]]}}
+
+    async def close(self):
+        pass
+
+
+def fake_annotation_result():
+    labels = random.sample(WORDS, 5)
+    return SimpleNamespace(
+        segment_label_annotations=[SimpleNamespace(entity=SimpleNamespace(description=label)) for label in labels],
+        explicit_annotation=SimpleNamespace(frames=[
+            SimpleNamespace(time_offset=timedelta(seconds=second), pornography_likelihood=random.choice([1, 1, 1, 2, 3, 4]))
+            for second in range(0, 60, 5)
+        ]),
+        speech_transcriptions=[
+            SimpleNamespace(alternatives=[SimpleNamespace(transcript=" ".join(random.choices(WORDS, k=40)))])
+        ]
+    )
+
+
+class FakeOperation:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def result(self, timeout=None):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(annotation_results=[fake_annotation_result()])
+
+
+class FakeVideoIntelligenceClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def annotate_video(self, request):
+        return FakeOperation(self.latency)
+
+
+# One keyframe every five seconds; the bytes never reach a decoder, since Vision is faked too
+async def fake_sample_keyframes(s3_key: str):
+    return [(float(second), b"keyframe") for second in range(0, 60, 5)]
+
+
+class FakeVisionClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def batch_annotate_images(self, requests):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(responses=[
+            SimpleNamespace(
+                error=SimpleNamespace(message=""),
+                label_annotations=[SimpleNamespace(description=label, score=random.random()) for label in random.sample(WORDS, 5)],
+                safe_search_annotation=SimpleNamespace(adult=random.choice([1, 1, 1, 2, 3, 4]))
+            )
+            for _ in requests
+        ])
+
+
+class FakeGeminiModels:
+    def __init__(self, latency: float, response_model):
+        self.latency = latency
+        self.response_model = response_model
+
+    async def generate_content(self, model, contents, config):
+        await asyncio.sleep(self.latency)
+        words = random.sample(WORDS, 3)
+        parsed = self.response_model(title=" ".join(words).title(), description=f"A video about {', '.join(words)}.")
+        return SimpleNamespace(parsed=parsed, text=parsed.model_dump_json())
+
+
+# Swap the real clients in main2 for the fakes; main2 creates clients lazily, so the
+# fakes are picked up wherever the get_* accessors are used
+def install_fakes(main2, es_latency: float, video_intelligence_latency: float, gemini_latency: float, vision_latency: float):
+    main2.es = FakeElasticsearch(es_latency)
+    main2.video_intelligence_client = FakeVideoIntelligenceClient(video_intelligence_latency)
+    main2.vision_client = FakeVisionClient(vision_latency)
+    main2.sample_keyframes = fake_sample_keyframes
+    main2.embedder = main2.HashingEmbedder(main2.EMBEDDING_DIMS)
+    main2.genAiClient = SimpleNamespace(aio=SimpleNamespace(models=FakeGeminiModels(gemini_latency, main2.TitleDescription)))
@@ -0,0 +1,61 @@
+"""Measure the overhead of the timed() stage instrumentation.
+
+Runs an empty stage and a trivial awaited stage with and without `with timed(...)` and
+prints the added cost per call. Set OTEL_TRACING=true (with opentelemetry installed) to
+include span creation in the measurement.
+
+Usage (from the backend directory):
+    python -m benchmarks.instrumentation --iterations 200000
+"""
+import argparse
+import asyncio
+import time
+
+from main2 import timed, tracer
+
+
+def bench_sync(iterations: int):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    bare = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with timed("benchmark"):
+            pass
+    instrumented = time.perf_counter() - started
+    return bare, instrumented
+
+
+async def bench_async(iterations: int):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await asyncio.sleep(0)
+    bare = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with timed("benchmark"):
+            await asyncio.sleep(0)
+    instrumented = time.perf_counter() - started
+    return bare, instrumented
+
+
+def report(name: str, iterations: int, bare: float, instrumented: float):
+    overhead = (instrumented - bare) / iterations * 1e9
+    print(f"{name}: {bare / iterations * 1e9:.0f} ns bare, {instrumented / iterations * 1e9:.0f} ns timed, +{overhead:.0f} ns per stage")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the overhead of stage instrumentation.")
+    parser.add_argument("--iterations", type=int, default=200000, help="calls per measurement")
+    args = parser.parse_args()
+
+    print(f"OpenTelemetry spans: {'on' if tracer is not None else 'off'}")
+    report("empty stage", args.iterations, *bench_sync(args.iterations))
+    report("awaited stage", args.iterations, *asyncio.run(bench_async(args.iterations)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""Load-test the API against local stand-ins for every external service.
+
+Starts moto as the S3 endpoint, points the app at SQLite (or --database-url, e.g. a local
+Postgres), swaps Elasticsearch, Video Intelligence, Cloud Vision, Gemini and keyframe extraction
+for the fakes in fakes.py, and drives the FastAPI app in-process with concurrent requests. For
+each scenario it reports throughput and p50/p99 latency; analysis jobs are also timed end to end.
+
+Results can be saved as a baseline and later runs compared against it, so regressions show up:
+    python -m benchmarks.load --save-baseline
+    python -m benchmarks.load               # exits 1 if a scenario got slower than the tolerance
+
+Usage (from the backend directory, after `pip install -r benchmarks/requirements.txt`):
+    python -m benchmarks.load --requests 500 --concurrency 20 --vi-latency 0.5 --gemini-latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import tempfile
+import time
+import uuid
+
+import boto3
+import httpx
+from moto.server import ThreadedMotoServer
+from sqlalchemy import func, select
+
+from benchmarks.fakes import WORDS, install_fakes
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def configure_environment(database_url: str, s3_endpoint: str):
+    os.environ.update({
+        "DATABASE_URL": database_url,
+        "AWS_ENDPOINT_URL_S3": s3_endpoint,
+        "AWS_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "ELASTICSEARCH_URL": "http://localhost:9200",
+        "GOOGLE_API_KEY": "benchmark",
+        "ANALYSIS_POLL_INTERVAL": "0.05",
+        "ES_OUTBOX_POLL_INTERVAL": "0.05",
+        "SNS_FLUSH_INTERVAL": "0.05",
+    })
+    os.environ.pop("REDIS_URL", None)
+    os.environ.pop("GCS_STAGING_BUCKET", None)
+
+
+def percentile(values: list, fraction: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(latencies: list, elapsed: float, errors: int):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+# Run `request(i)` for i in range(total) with `concurrency` requests in flight
+async def run_scenario(request, total: int, concurrency: int):
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            response = await request(i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+# Poll until every job finished; a job's latency runs from its first /analyze call until it is seen done
+async def wait_for_jobs(client: httpx.AsyncClient, queued_at: dict, timeout: float):
+    started = time.perf_counter()
+    remaining = set(queued_at)
+    latencies = []
+    failed = 0
+    while remaining and time.perf_counter() - started < timeout:
+        for job_id in list(remaining):
+            job = (await client.get(f"/jobs/{job_id}")).json()
+            if job["status"] in ("succeeded", "failed"):
+                remaining.discard(job_id)
+                latencies.append(time.perf_counter() - queued_at[job_id])
+                failed += job["status"] == "failed"
+        await asyncio.sleep(0.05)
+    return summarize(latencies or [0.0], time.perf_counter() - started, failed + len(remaining))
+
+
+# The relay logs and retries its failures, so they are recorded here; a run whose search index
+# never filled up would otherwise time /search and /related against an empty index
+def track_outbox_failures(main2):
+    failures = []
+    drain = main2.drain_es_outbox
+
+    async def tracked():
+        try:
+            return await drain()
+        except Exception as e:
+            failures.append(e)
+            raise
+
+    main2.drain_es_outbox = tracked
+    return failures
+
+
+# Wait for the relay to empty the outbox, then check every video made it into the fake index
+async def wait_for_search_index(main2, failures: list, expected: int, timeout: float):
+    started = time.perf_counter()
+    while True:
+        if failures:
+            raise SystemExit(f"Elasticsearch outbox relay failed: {failures[0]!r}")
+        async with main2.SessionLocal() as db:
+            pending = await db.scalar(select(func.count()).select_from(main2.EsOutbox))
+        if not pending:
+            break
+        if time.perf_counter() - started > timeout:
+            raise SystemExit(f"{pending} Elasticsearch outbox entries were still pending after {timeout}s")
+        await asyncio.sleep(0.05)
+
+    indexed = len(main2.es.documents)
+    if indexed < expected:
+        raise SystemExit(f"Only {indexed} of {expected} videos reached the search index")
+
+
+async def run(args):
+    import main2
+
+    # uploads land in SOURCE_BUCKET, so analysis reads from there too
+    main2.bucket_name = main2.SOURCE_BUCKET
+    install_fakes(main2, args.es_latency, args.vi_latency, args.gemini_latency, args.vision_latency)
+    relay_failures = track_outbox_failures(main2)
+
+    # The app leaves the schema to Alembic; the throwaway database gets its tables directly
+    async with main2.get_engine().begin() as conn:
+        await conn.run_sync(main2.Base.metadata.create_all)
+
+    payload = os.urandom(args.file_size)
+    results = {}
+
+    async with main2.app.router.lifespan_context(main2.app):
+        transport = httpx.ASGITransport(app=main2.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            video_ids = []
+
+            async def upload(i):
+                # a distinct trailer per request keeps dedup from short-circuiting the upload
+                files = {"file": (f"{i}.mp4", payload + uuid.uuid4().bytes, "video/mp4")}
+                response = await client.post("/upload", files=files, data={"title": " ".join(random.sample(WORDS, 3))})
+                if response.status_code < 400:
+                    video_ids.append(response.json()["video_id"])
+                return response
+            results["upload"] = await run_scenario(upload, args.requests, args.concurrency)
+
+            queued_at = {}
+
+            async def analyze(i):
+                response = await client.post(f"/analyze/{video_ids[i % len(video_ids)]}", params={"tier": args.tier} if args.tier else None)
+                if response.status_code < 400:
+                    queued_at.setdefault(response.json()["job_id"], time.perf_counter())
+                return response
+            results["analyze"] = await run_scenario(analyze, args.requests, args.concurrency)
+            results["analysis_jobs"] = await wait_for_jobs(client, queued_at, args.job_timeout)
+            await wait_for_search_index(main2, relay_failures, len(video_ids), args.job_timeout)
+
+            async def search(i):
+                return await client.get("/search", params={"query": random.choice(WORDS)})
+            results["search"] = await run_scenario(search, args.requests, args.concurrency)
+
+            async def related(i):
+                return await client.get(f"/videos/{random.choice(video_ids)}/related")
+            results["related"] = await run_scenario(related, args.requests, args.concurrency)
+
+            async def videos(i):
+                if i % 2:
+                    return await client.get(f"/videos/{random.choice(video_ids)}")
+                return await client.get("/videos", params={"limit": 50})
+            results["videos"] = await run_scenario(videos, args.requests, args.concurrency)
+
+            async def mediaconvert_callback(i):
+                video_id = video_ids[i % len(video_ids)]
+                notification = {
+                    "Type": "Notification",
+                    "MessageId": str(uuid.uuid4()),
+                    "Message": json.dumps({"Outputs": {"HLS_GROUP": [f"https://cdn.example.com/hls/{video_id}.m3u8"]}})
+                }
+                return await client.post("/mediaconvert-callback", content=json.dumps(notification))
+            results["mediaconvert_callback"] = await run_scenario(mediaconvert_callback, args.requests, args.concurrency)
+
+    return results
+
+
+# A scenario regresses when its throughput drops or its p99 grows by more than the tolerance
+def compare(results: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput']}/s vs baseline {previous['throughput']}/s")
+        if current["p99_ms"] > previous["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {current['p99_ms']}ms vs baseline {previous['p99_ms']}ms")
+    return regressions
+
+
+def print_results(results: dict):
+    print(f"{'scenario':<24}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<24}{result['requests']:>10}{result['errors']:>8}{result['throughput']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the API against local fakes.")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight")
+    parser.add_argument("--file-size", type=int, default=256 * 1024, help="bytes per uploaded file")
+    parser.add_argument("--database-url", help="database to use instead of a temporary SQLite file")
+    parser.add_argument("--es-latency", type=float, default=0.005, help="seconds per fake Elasticsearch call")
+    parser.add_argument("--vi-latency", type=float, default=0.5, help="seconds per fake Video Intelligence operation")
+    parser.add_argument("--gemini-latency", type=float, default=0.2, help="seconds per fake Gemini call")
+    parser.add_argument("--vision-latency", type=float, default=0.3, help="seconds per fake Cloud Vision batch")
+    parser.add_argument("--tier", choices=["fast", "full"], help="analysis tier to request (default: the app's default)")
+    parser.add_argument("--job-timeout", type=float, default=300, help="seconds to wait for analysis jobs")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="cliptag-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    try:
+        endpoint = f"http://127.0.0.1:{port}"
+        configure_environment(database_url, endpoint)
+
+        from main2 import SOURCE_BUCKET, UPLOAD_STAGING_BUCKET
+        s3 = boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1", aws_access_key_id="benchmark", aws_secret_access_key="benchmark")
+        for bucket in {SOURCE_BUCKET, UPLOAD_STAGING_BUCKET}:
+            s3.create_bucket(Bucket=bucket)
+
+        results = asyncio.run(run(args))
+    finally:
+        server.stop()
+
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
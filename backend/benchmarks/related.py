@@ -0,0 +1,144 @@
+"""Benchmark the related-videos kNN query at production scale.
+
+Loads --vectors synthetic embeddings (clustered, so neighbours are meaningful) into a scratch
+index on the configured Elasticsearch cluster, using the `embedding` field of the videos
+mapping, then runs the same approximate kNN query as GET /videos/{video_id}/related with
+concurrent requests. Reports load time, throughput and p50/p99 latency, and recall@k against
+an exact script_score search on a sample of the queries.
+
+Usage (from the backend directory, with ELASTICSEARCH_URL pointing at a test cluster):
+    python -m benchmarks.related --vectors 100000 --queries 2000 --concurrency 16
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from elasticsearch.helpers import async_bulk
+
+from main2 import get_es, close_clients, related_query, VIDEOS_INDEX_MAPPING, EMBEDDING_DIMS, RELATED_MAX, RELATED_NUM_CANDIDATES
+
+
+def percentile(values: list, fraction: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+# Points scattered around random cluster centres
+def clustered_vectors(rng, centres, count: int, spread: float):
+    picked = centres[rng.integers(0, len(centres), count)]
+    return normalize(picked + rng.normal(0, spread, picked.shape).astype(np.float32))
+
+
+async def load(es, index: str, rng, centres, total: int, spread: float, chunk_size: int):
+    await es.indices.create(index=index, body={
+        "mappings": {"properties": {
+            "video_id": VIDEOS_INDEX_MAPPING["properties"]["video_id"],
+            "embedding": {**VIDEOS_INDEX_MAPPING["properties"]["embedding"], "dims": int(centres.shape[1])}
+        }},
+        "settings": {"number_of_replicas": 0, "refresh_interval": "-1"}
+    })
+
+    async def actions():
+        for start in range(0, total, chunk_size):
+            vectors = clustered_vectors(rng, centres, min(chunk_size, total - start), spread)
+            for offset, vector in enumerate(vectors):
+                video_id = f"video-{start + offset}"
+                yield {"_index": index, "_id": video_id, "_source": {"video_id": video_id, "embedding": vector.tolist()}}
+
+    started = time.perf_counter()
+    await async_bulk(es, actions(), chunk_size=chunk_size)
+    await es.indices.refresh(index=index)
+    loaded = time.perf_counter() - started
+
+    # Search latency depends on the number of segments, so measure a merged index like a settled production one
+    started = time.perf_counter()
+    await es.indices.forcemerge(index=index, max_num_segments=1)
+    return loaded, time.perf_counter() - started
+
+
+async def run_queries(es, index: str, queries, k: int, num_candidates: int, concurrency: int):
+    latencies = []
+    results = [None] * len(queries)
+    counter = iter(range(len(queries)))
+
+    async def worker():
+        for i in counter:
+            body = related_query(f"query-{i}", queries[i].tolist(), k=k, num_candidates=num_candidates)
+            started = time.perf_counter()
+            response = await es.search(index=index, body=body)
+            latencies.append(time.perf_counter() - started)
+            results[i] = [hit["_id"] for hit in response["hits"]["hits"]]
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, time.perf_counter() - started, results
+
+
+async def exact_neighbours(es, index: str, query, k: int):
+    response = await es.search(index=index, body={
+        "size": k,
+        "_source": False,
+        "query": {"script_score": {
+            "query": {"match_all": {}},
+            "script": {"source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0", "params": {"query_vector": query.tolist()}}
+        }}
+    })
+    return [hit["_id"] for hit in response["hits"]["hits"]]
+
+
+async def benchmark(args):
+    es = get_es()
+    rng = np.random.default_rng(args.seed)
+    centres = normalize(rng.normal(0, 1, (args.clusters, args.dims)).astype(np.float32))
+
+    if await es.indices.exists(index=args.index):
+        await es.indices.delete(index=args.index)
+    try:
+        loaded, merged = await load(es, args.index, rng, centres, args.vectors, args.spread, args.chunk_size)
+        print(f"Loaded {args.vectors} vectors of {args.dims} dims in {loaded:.1f}s ({args.vectors / loaded:.0f}/sec), force-merged in {merged:.1f}s")
+
+        queries = clustered_vectors(rng, centres, args.queries, args.spread)
+        latencies, elapsed, results = await run_queries(es, args.index, queries, args.k, args.num_candidates, args.concurrency)
+        print(
+            f"{len(latencies)} kNN queries (k={args.k}, num_candidates={args.num_candidates}): {len(latencies) / elapsed:.0f} queries/sec,"
+            f" p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p99 {percentile(latencies, 0.99) * 1000:.1f}ms"
+        )
+
+        sample = range(min(args.recall_sample, args.queries))
+        found = 0
+        for i in sample:
+            exact = set(await exact_neighbours(es, args.index, queries[i], args.k))
+            found += len(exact & set(results[i]))
+        print(f"recall@{args.k} over {len(sample)} queries: {found / (len(sample) * args.k):.3f}")
+    finally:
+        if not args.keep:
+            await es.indices.delete(index=args.index)
+        await close_clients()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the related-videos kNN query.")
+    parser.add_argument("--vectors", type=int, default=100000, help="embeddings loaded into the scratch index")
+    parser.add_argument("--dims", type=int, default=EMBEDDING_DIMS, help="embedding dimensions")
+    parser.add_argument("--clusters", type=int, default=1000, help="topics the synthetic videos are spread over")
+    parser.add_argument("--spread", type=float, default=0.05, help="noise around each cluster centre")
+    parser.add_argument("--queries", type=int, default=1000, help="kNN queries to run")
+    parser.add_argument("--concurrency", type=int, default=16, help="queries in flight")
+    parser.add_argument("--k", type=int, default=RELATED_MAX, help="neighbours per query")
+    parser.add_argument("--num-candidates", type=int, default=RELATED_NUM_CANDIDATES, help="HNSW candidates per shard")
+    parser.add_argument("--recall-sample", type=int, default=50, help="queries checked against an exact search")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="documents per bulk request")
+    parser.add_argument("--index", default="related_benchmark", help="scratch index name")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch index afterwards")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
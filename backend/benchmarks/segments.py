@@ -0,0 +1,168 @@
+"""Check segmented analysis: results stay in video order and wall-clock time drops with concurrency.
+
+Splits a --duration second video into ANALYSIS_SEGMENT_SECONDS segments with main2.video_segments
+and runs main2.annotate_segments over them with a fake annotator. Each segment takes --latency
+seconds plus up to --jitter of it again, so segments finish out of order, and returns labels,
+explicit-content frames (offsets relative to the start of the video, as the API reports them)
+and a transcript that name the segment. main2.merge_annotations must put all three back in video
+order. This is repeated for each --concurrency value (ANALYSIS_SEGMENT_CONCURRENCY), reporting the
+wall-clock time against the ideal of ceil(segments / concurrency) rounds.
+
+With --video, the duration comes from main2.probe_duration on that file served by moto, which
+needs ffprobe on the PATH.
+
+Usage (from the backend directory, after `pip install -r benchmarks/requirements.txt`):
+    python -m benchmarks.segments --duration 3600 --latency 0.5 --concurrency 1,2,4,8
+    python -m benchmarks.segments --video sample.mp4 --segment-seconds 10
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+import boto3
+
+from benchmarks.staging import BUCKET, KEY, free_port, start_moto
+
+FEATURES = ["labels", "explicit_content", "transcription"]
+FRAME_INTERVAL = 5
+
+
+class FakeAnnotator:
+    def __init__(self, segments: list, latency: float, jitter: float):
+        self.index = {segment: i for i, segment in enumerate(segments)}
+        self.latency = latency
+        self.jitter = jitter
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, video_input: dict, segment, features: list):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency * (1 + random.random() * self.jitter))
+        finally:
+            self.in_flight -= 1
+        return segment_result(self.index[segment], segment)
+
+
+def segment_result(i: int, segment):
+    start, end = segment if segment is not None else (0, FRAME_INTERVAL)
+    return SimpleNamespace(
+        segment_label_annotations=[
+            SimpleNamespace(entity=SimpleNamespace(description=label)) for label in (f"segment-{i}", "shared")
+        ],
+        explicit_annotation=SimpleNamespace(frames=[
+            SimpleNamespace(time_offset=timedelta(seconds=second), pornography_likelihood=1)
+            for second in reversed(range(math.ceil(start), math.ceil(end), FRAME_INTERVAL))
+        ]),
+        speech_transcriptions=[SimpleNamespace(alternatives=[SimpleNamespace(transcript=f"segment {i}")])],
+    )
+
+
+# What merge_annotations should make of the segments, in video order
+def expected_results(segments: list):
+    labels = ["segment-0", "shared"] + [f"segment-{i}" for i in range(1, len(segments))]
+    offsets = []
+    for segment in segments:
+        start, end = segment if segment is not None else (0, FRAME_INTERVAL)
+        offsets += list(range(math.ceil(start), math.ceil(end), FRAME_INTERVAL))
+    transcripts = [f"segment {i}" for i in range(len(segments))]
+    return labels, offsets, transcripts
+
+
+def check_order(merged: dict, segments: list):
+    labels, offsets, transcripts = expected_results(segments)
+    failures = []
+    if merged["labels"] != labels:
+        failures.append(f"labels out of order: {merged['labels'][:6]}...")
+    if [frame["time_offset"] for frame in merged["explicit_content"]] != offsets:
+        failures.append("explicit content frames out of order or missing")
+    if merged["transcription"] != transcripts:
+        failures.append(f"transcripts out of order: {merged['transcription'][:6]}...")
+    return failures
+
+
+async def probe_video(main2, path: str):
+    port = free_port()
+    server = start_moto(port)
+    try:
+        endpoint = f"http://127.0.0.1:{port}"
+        os.environ.update({
+            "AWS_ENDPOINT_URL_S3": endpoint,
+            "AWS_REGION": "us-east-1",
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+        })
+        s3 = boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1", aws_access_key_id="benchmark", aws_secret_access_key="benchmark")
+        s3.create_bucket(Bucket=BUCKET)
+        s3.upload_file(path, BUCKET, KEY)
+        main2.bucket_name = BUCKET
+        try:
+            return await main2.probe_duration(KEY)
+        finally:
+            await main2.close_clients()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def run(args, concurrencies: list):
+    import main2
+
+    duration = await probe_video(main2, args.video) if args.video else args.duration
+    segments = main2.video_segments(duration, args.segment_seconds)
+    print(f"{duration:.0f}s video in {len(segments)} segments of {args.segment_seconds}s, "
+          f"{args.latency}s per segment (+ up to {args.jitter:.0%} jitter)")
+
+    rows = []
+    failures = []
+    for concurrency in concurrencies:
+        main2.ANALYSIS_SEGMENT_CONCURRENCY = concurrency
+        annotator = FakeAnnotator(segments, args.latency, args.jitter)
+        started = time.perf_counter()
+        annotation_results = await main2.annotate_segments({"input_uri": "gs://benchmark/video.mp4"}, segments, FEATURES, annotate=annotator)
+        elapsed = time.perf_counter() - started
+        merged = main2.merge_annotations(annotation_results, FEATURES)
+
+        ideal = math.ceil(len(segments) / concurrency) * args.latency
+        rows.append((concurrency, annotator.max_in_flight, elapsed, ideal))
+        failures += [f"concurrency {concurrency}: {failure}" for failure in check_order(merged, segments)]
+        if annotator.max_in_flight != min(concurrency, len(segments)):
+            failures.append(f"concurrency {concurrency}: {annotator.max_in_flight} segments ran at once")
+        if elapsed > ideal * (1 + args.jitter) * args.max_overhead:
+            failures.append(f"concurrency {concurrency}: {elapsed:.2f}s is over {args.max_overhead}x the ideal {ideal:.2f}s")
+    return rows, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check ordering and parallelism of segmented analysis.")
+    parser.add_argument("--duration", type=float, default=3600, help="video length in seconds")
+    parser.add_argument("--video", help="probe this file's duration with ffprobe instead of using --duration")
+    parser.add_argument("--segment-seconds", type=int, default=300, help="ANALYSIS_SEGMENT_SECONDS to split with")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the fake annotator takes per segment")
+    parser.add_argument("--jitter", type=float, default=0.5, help="extra latency per segment, up to this share of --latency")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="comma-separated ANALYSIS_SEGMENT_CONCURRENCY values")
+    parser.add_argument("--max-overhead", type=float, default=1.2, help="exit 1 if wall-clock exceeds the ideal (with jitter) by this factor")
+    args = parser.parse_args()
+
+    concurrencies = [int(concurrency) for concurrency in args.concurrency.split(",")]
+    rows, failures = asyncio.run(run(args, concurrencies))
+
+    baseline = rows[0][2]
+    print(f"{'concurrency':>12}{'in flight':>11}{'wall s':>9}{'ideal s':>9}{'speedup':>9}")
+    for concurrency, in_flight, elapsed, ideal in rows:
+        print(f"{concurrency:>12}{in_flight:>11}{elapsed:>9.2f}{ideal:>9.2f}{baseline / elapsed:>9.1f}")
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        raise SystemExit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
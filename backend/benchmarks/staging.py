@@ -0,0 +1,174 @@
+"""Check that staging a video for Video Intelligence uses bounded memory.
+
+Starts moto as the S3 endpoint in a separate process (moto reads whole objects into memory
+to serve them, so it must not share this process's heap), uploads a --size byte object and
+runs main2.stage_video_input on it with a fake GCS writer that only counts and hashes the
+bytes. The peak of Python allocations during staging must stay under --max-peak-mib whatever
+the file size. With GCS_STAGING_BUCKET unset, the same file must be refused rather than read
+into memory.
+
+Usage (from the backend directory, after `pip install -r benchmarks/requirements.txt`):
+    python -m benchmarks.staging --size 1073741824 --max-peak-mib 64
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import boto3
+
+BUCKET = "cliptag-staging-benchmark"
+KEY = "assets01/videos/staging-benchmark.mp4"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_moto(port: int):
+    server = subprocess.Popen([sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise SystemExit("moto server did not start")
+
+
+# Written from a file in parts, so the benchmark itself never holds the object in memory
+def upload_object(s3, size: int):
+    sha256 = hashlib.sha256()
+    with tempfile.TemporaryFile() as f:
+        remaining = size
+        while remaining:
+            chunk = os.urandom(min(remaining, 8 * 1024 * 1024))
+            sha256.update(chunk)
+            f.write(chunk)
+            remaining -= len(chunk)
+        f.seek(0)
+        s3.upload_fileobj(f, BUCKET, KEY)
+    return sha256.hexdigest()
+
+
+class FakeStagedFile:
+    def __init__(self):
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        self.sha256.update(chunk)
+
+    def close(self):
+        pass
+
+
+class FakeBlob:
+    def __init__(self, name: str):
+        self.name = name
+        self.staged_file = FakeStagedFile()
+
+    def open(self, mode, chunk_size=None):
+        return self.staged_file
+
+
+class FakeBucket:
+    def __init__(self):
+        self.blobs = []
+
+    def blob(self, name: str):
+        self.blobs.append(FakeBlob(name))
+        return self.blobs[-1]
+
+
+async def run(args, expected_sha256: str):
+    import main2
+
+    main2.bucket_name = BUCKET
+    gcs_bucket = FakeBucket()
+    main2.gcs_client = type("FakeGcsClient", (), {"bucket": lambda self, name: gcs_bucket})()
+    await main2.get_s3_client()
+
+    try:
+        tracemalloc.start()
+        started = time.perf_counter()
+        video_input, blob = await main2.stage_video_input(KEY)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        main2.GCS_STAGING_BUCKET = None
+        try:
+            await main2.stage_video_input(KEY)
+            refused = False
+        except ValueError:
+            refused = True
+    finally:
+        await main2.close_clients()
+
+    staged = blob.staged_file if blob is not None else None
+    return {
+        "input_uri": video_input.get("input_uri"),
+        "intact": staged is not None and staged.size == args.size and staged.sha256.hexdigest() == expected_sha256,
+        "peak_mib": peak / 1024 / 1024,
+        "throughput_mib_s": args.size / 1024 / 1024 / elapsed,
+        "refused_inline": refused,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the memory ceiling of video staging.")
+    parser.add_argument("--size", type=int, default=512 * 1024 * 1024, help="bytes in the test object")
+    parser.add_argument("--max-peak-mib", type=float, default=64, help="exit 1 if staging allocates more than this at its peak")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_moto(port)
+    try:
+        endpoint = f"http://127.0.0.1:{port}"
+        os.environ.update({
+            "AWS_ENDPOINT_URL_S3": endpoint,
+            "AWS_REGION": "us-east-1",
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "GCS_STAGING_BUCKET": "cliptag-staging-benchmark",
+        })
+        s3 = boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1", aws_access_key_id="benchmark", aws_secret_access_key="benchmark")
+        s3.create_bucket(Bucket=BUCKET)
+        expected_sha256 = upload_object(s3, args.size)
+        result = asyncio.run(run(args, expected_sha256))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"staged {args.size / 1024 / 1024:.0f} MiB to {result['input_uri']} at {result['throughput_mib_s']:.1f} MiB/s")
+    print(f"peak allocations during staging: {result['peak_mib']:.1f} MiB (ceiling {args.max_peak_mib} MiB)")
+
+    failures = []
+    if result["input_uri"] is None:
+        failures.append("the file was sent inline instead of staged")
+    elif not result["intact"]:
+        failures.append("the staged bytes differ from the uploaded object")
+    if result["peak_mib"] > args.max_peak_mib:
+        failures.append(f"peak {result['peak_mib']:.1f} MiB exceeds {args.max_peak_mib} MiB")
+    if not result["refused_inline"]:
+        failures.append("without GCS_STAGING_BUCKET the file was not refused")
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        raise SystemExit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Measure /upload throughput and latency for multipart-sized files against moto.
+
+load.py uploads small files, which S3 takes in a single PUT. This benchmark sends files above
+UPLOAD_PART_SIZE, so every request goes through the concurrent multipart transfer, the hashing
+reader and the server-side copy into place. moto runs in a separate process so its copies of the
+objects don't count towards the API's memory. Reports requests/s, MiB/s, p50/p99 latency and the
+peak of Python allocations while the uploads ran.
+
+Usage (from the backend directory, after `pip install -r benchmarks/requirements.txt`):
+    python -m benchmarks.upload --file-size 134217728 --requests 20 --concurrency 4
+    python -m benchmarks.upload --part-size 8388608 --upload-concurrency 16
+"""
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import tracemalloc
+import uuid
+
+import boto3
+import httpx
+
+from benchmarks.load import configure_environment, free_port, run_scenario
+from benchmarks.staging import start_moto
+
+
+# Streams the shared payload file followed by a unique trailer, which keeps dedup from
+# short-circuiting the upload; the client never holds a whole file in memory
+class TrailedFile(io.RawIOBase):
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.trailer = uuid.uuid4().bytes
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunk = self.file.read(size)
+        if not chunk and self.trailer:
+            chunk, self.trailer = self.trailer, b""
+        return chunk
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def write_payload(path: str, size: int):
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            chunk = os.urandom(min(remaining, 8 * 1024 * 1024))
+            f.write(chunk)
+            remaining -= len(chunk)
+
+
+async def run(args, payload_path: str):
+    import main2
+
+    async with main2.get_engine().begin() as conn:
+        await conn.run_sync(main2.Base.metadata.create_all)
+
+    try:
+        transport = httpx.ASGITransport(app=main2.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=600) as client:
+            async def upload(i):
+                with TrailedFile(payload_path) as f:
+                    return await client.post("/upload", files={"file": (f"{i}.mp4", f, "video/mp4")})
+
+            tracemalloc.start()
+            result = await run_scenario(upload, args.requests, args.concurrency)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        await main2.close_clients()
+
+    result["mib_per_s"] = round(result["throughput"] * args.file_size / 1024 / 1024, 1)
+    result["peak_mib"] = round(peak / 1024 / 1024, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multipart /upload against moto.")
+    parser.add_argument("--requests", type=int, default=20, help="uploads to send")
+    parser.add_argument("--concurrency", type=int, default=4, help="uploads in flight")
+    parser.add_argument("--file-size", type=int, default=128 * 1024 * 1024, help="bytes per uploaded file")
+    parser.add_argument("--part-size", type=int, help="UPLOAD_PART_SIZE to run with")
+    parser.add_argument("--upload-concurrency", type=int, help="UPLOAD_CONCURRENCY to run with")
+    parser.add_argument("--database-url", help="database to use instead of a temporary SQLite file")
+    args = parser.parse_args()
+
+    if args.part_size:
+        os.environ["UPLOAD_PART_SIZE"] = str(args.part_size)
+    if args.upload_concurrency:
+        os.environ["UPLOAD_CONCURRENCY"] = str(args.upload_concurrency)
+
+    workdir = tempfile.mkdtemp(prefix="cliptag-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+
+    port = free_port()
+    server = start_moto(port)
+    try:
+        endpoint = f"http://127.0.0.1:{port}"
+        configure_environment(database_url, endpoint)
+
+        from main2 import SOURCE_BUCKET, UPLOAD_STAGING_BUCKET, UPLOAD_PART_SIZE, UPLOAD_CONCURRENCY
+        s3 = boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1", aws_access_key_id="benchmark", aws_secret_access_key="benchmark")
+        for bucket in {SOURCE_BUCKET, UPLOAD_STAGING_BUCKET}:
+            s3.create_bucket(Bucket=bucket)
+
+        payload_path = os.path.join(workdir, "payload.mp4")
+        write_payload(payload_path, args.file_size)
+        result = asyncio.run(run(args, payload_path))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{args.requests} uploads of {args.file_size / 1024 / 1024:.0f} MiB, {args.concurrency} in flight, "
+          f"parts of {UPLOAD_PART_SIZE / 1024 / 1024:.0f} MiB with {UPLOAD_CONCURRENCY} in flight per upload")
+    print(f"{'errors':>8}{'req/s':>10}{'MiB/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MiB':>10}")
+    print(f"{result['errors']:>8}{result['throughput']:>10}{result['mib_per_s']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}{result['peak_mib']:>10}")
+    if result["errors"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Bulk-import existing S3 videos and analyse them.
+
+Lists a prefix of the source bucket page by page, bulk-inserts a Video row for every video
+object that is not registered yet (indexed through the outbox like /upload), and feeds the
+new rows through a bounded pool of analysis workers that run the same analysis as the API.
+Finished results are written in batches, many videos per transaction. Video Intelligence,
+Cloud Vision and Gemini calls are throttled per API. --tier fast tags from keyframes; --tier full
+runs the whole-video analysis.
+
+Progress is checkpointed to a JSON file (the last listed key, videos waiting for analysis and
+failures), so an interrupted run picks up where it stopped when started again.
+
+Usage (from the backend directory):
+    python ingest.py --prefix assets01/videos/ --workers 8 --vi-rate 60 --gemini-rate 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+import main2
+from main2 import (
+    get_engine, get_s3_client, close_clients, SessionLocal, Video, RateLimiter, ANALYSIS_FEATURES, ANALYSIS_TIERS, ANALYSIS_DEFAULT_TIER,
+    compute_analysis, persist_analysis_results, bucket_name, es_outbox_relay, drain_es_outbox, notify_es_outbox,
+    queue_es_document, video_document
+)
+
+VIDEO_SUFFIXES = (".mp4", ".mov", ".m4v", ".mkv", ".webm", ".avi")
+
+
+class Checkpoint:
+    def __init__(self, path: str, prefix: str):
+        self.path = path
+        self.prefix = prefix
+        self.last_key = None
+        self.pending = {}  # video_id -> s3 key, inserted but not analysed yet
+        self.failed = {}  # video_id -> error
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            state = json.load(f)
+        if state["prefix"] != self.prefix:
+            raise SystemExit(f"{self.path} belongs to prefix '{state['prefix']}', not '{self.prefix}'")
+        self.last_key = state["last_key"]
+        self.pending = state["pending"]
+        self.failed = state["failed"]
+
+    # Write to a temporary file and rename, so a crash never leaves a half-written checkpoint
+    def save(self):
+        state = {"prefix": self.prefix, "last_key": self.last_key, "pending": self.pending, "failed": self.failed}
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class Progress:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.listed = 0
+        self.inserted = 0
+        self.analysed = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def tick(self):
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        print(
+            f"{self.listed} listed, {self.inserted} inserted, {self.analysed} analysed, {self.failed} failed"
+            f" | {self.inserted / elapsed:.1f} inserts/sec, {self.analysed / elapsed * 60:.1f} analyses/min"
+        )
+
+
+# Keep the UUID of keys already named <uuid>.mp4; anything else gets a stable UUID derived
+# from the key, so a re-run maps the same object to the same video_id
+def video_id_for_key(key: str):
+    stem = os.path.splitext(os.path.basename(key))[0]
+    try:
+        return str(uuid.UUID(stem))
+    except ValueError:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"s3://{bucket_name}/{key}"))
+
+
+def insert_videos_statement():
+    dialect = postgresql if get_engine().dialect.name == "postgresql" else sqlite
+    return dialect.insert(Video).on_conflict_do_nothing(index_elements=["video_id"]).returning(Video.video_id)
+
+
+# Insert one page of keys in a single statement and return the videos that still need analysis:
+# the ones just inserted, plus earlier rows that were never analysed (e.g. a crash before the
+# checkpoint was written)
+async def insert_videos(keys: list):
+    rows = [{"video_id": video_id_for_key(key), "s3_url": key, "duration": 120, "title": os.path.basename(key), "description": "N/A"} for key in keys]
+    async with SessionLocal() as db:
+        inserted = set((await db.scalars(insert_videos_statement(), rows)).all())
+        for row in rows:
+            if row["video_id"] in inserted:
+                queue_es_document(db, row["video_id"], video_document(Video(**row)))
+        await db.commit()
+        notify_es_outbox()
+
+        unanalysed = (await db.execute(
+            select(Video.video_id, Video.s3_url).where(
+                Video.video_id.in_([row["video_id"] for row in rows]),
+                Video.tags.is_(None),
+                Video.ai_generated_title.is_(None)
+            )
+        )).all()
+    return len(inserted), dict(unanalysed)
+
+
+async def produce(queue: asyncio.Queue, prefix: str, page_size: int, workers: int, checkpoint: Checkpoint, progress: Progress):
+    # Videos left over from an interrupted run go first
+    for video_id, key in list(checkpoint.pending.items()):
+        await queue.put((video_id, key))
+
+    params = {"Bucket": bucket_name, "Prefix": prefix, "PaginationConfig": {"PageSize": page_size}}
+    if checkpoint.last_key:
+        params["StartAfter"] = checkpoint.last_key
+
+    paginator = (await get_s3_client()).get_paginator("list_objects_v2")
+    async for page in paginator.paginate(**params):
+        objects = page.get("Contents", [])
+        if not objects:
+            continue
+        keys = [obj["Key"] for obj in objects if obj["Key"].lower().endswith(VIDEO_SUFFIXES)]
+        progress.listed += len(keys)
+
+        to_analyse = {}
+        if keys:
+            inserted, unanalysed = await insert_videos(keys)
+            progress.inserted += inserted
+            to_analyse = {video_id: key for video_id, key in unanalysed.items() if video_id not in checkpoint.pending and video_id not in checkpoint.failed}
+
+        checkpoint.last_key = objects[-1]["Key"]
+        checkpoint.pending.update(to_analyse)
+        checkpoint.save()
+        progress.tick()
+
+        # Blocks while the workers are busy, so listing never runs far ahead of analysis
+        for item in to_analyse.items():
+            await queue.put(item)
+
+    for _ in range(workers):
+        await queue.put(None)
+
+
+async def consume(queue: asyncio.Queue, finished: asyncio.Queue, features: list, tier: str, checkpoint: Checkpoint, progress: Progress):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        video_id, key = item
+        try:
+            async with SessionLocal() as db:
+                await finished.put(await compute_analysis(video_id, key, db, features=features, tier=tier))
+        except Exception as e:
+            print(f"Analysis of {video_id} ({key}) failed: {e}")
+            checkpoint.failed[video_id] = str(e)
+            checkpoint.pending.pop(video_id, None)
+            progress.failed += 1
+            progress.tick()
+
+
+# Write finished results flush_size at a time, or whatever has arrived after flush_interval
+async def persist(finished: asyncio.Queue, flush_size: int, flush_interval: float, checkpoint: Checkpoint, progress: Progress):
+    done = False
+    while not done:
+        batch = []
+        deadline = asyncio.get_running_loop().time() + flush_interval
+        while len(batch) < flush_size:
+            try:
+                result = await asyncio.wait_for(finished.get(), timeout=max(0, deadline - asyncio.get_running_loop().time()))
+            except asyncio.TimeoutError:
+                break
+            if result is None:
+                done = True
+                break
+            batch.append(result)
+        if not batch:
+            continue
+
+        try:
+            async with SessionLocal() as db:
+                await persist_analysis_results(db, batch)
+            progress.analysed += len(batch)
+        except Exception as e:
+            print(f"Writing {len(batch)} analysis results failed: {e}")
+            for result in batch:
+                checkpoint.failed[result.video_id] = str(e)
+            progress.failed += len(batch)
+        for result in batch:
+            checkpoint.pending.pop(result.video_id, None)
+        progress.tick()
+
+
+async def save_periodically(checkpoint: Checkpoint, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        checkpoint.save()
+
+
+async def ingest(prefix: str, page_size: int, workers: int, flush_size: int, features: list, tier: str, checkpoint: Checkpoint, skip_analysis: bool):
+    progress = Progress(interval=10.0)
+    queue = asyncio.Queue(maxsize=workers * 2)
+    saver = asyncio.create_task(save_periodically(checkpoint, 5.0))
+    relay = asyncio.create_task(es_outbox_relay())
+    try:
+        if skip_analysis:
+            # List and insert only; the queue is drained without analysing
+            async def discard():
+                while await queue.get() is not None:
+                    pass
+            await asyncio.gather(produce(queue, prefix, page_size, 1, checkpoint, progress), discard())
+        else:
+            finished = asyncio.Queue()
+            writer = asyncio.create_task(persist(finished, flush_size, 2.0, checkpoint, progress))
+            await asyncio.gather(
+                produce(queue, prefix, page_size, workers, checkpoint, progress),
+                *[consume(queue, finished, features, tier, checkpoint, progress) for _ in range(workers)]
+            )
+            await finished.put(None)
+            await writer
+    finally:
+        saver.cancel()
+        relay.cancel()
+        await asyncio.gather(saver, relay, return_exceptions=True)
+        checkpoint.save()
+
+    # Send whatever the relay had not picked up yet
+    while await drain_es_outbox():
+        pass
+    progress.report()
+    if checkpoint.failed:
+        print(f"{len(checkpoint.failed)} videos failed analysis; rerun with --retry-failed to try them again.")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Import and analyse existing videos from the S3 source bucket.")
+    parser.add_argument("--prefix", default="", help="S3 key prefix to import")
+    parser.add_argument("--page-size", type=int, default=1000, help="keys listed and inserted per batch")
+    parser.add_argument("--workers", type=int, default=4, help="videos analysed concurrently")
+    parser.add_argument("--flush-size", type=int, default=50, help="analysis results written per transaction")
+    parser.add_argument("--tier", choices=ANALYSIS_TIERS, default=ANALYSIS_DEFAULT_TIER, help="fast (keyframes + Cloud Vision) or full (Video Intelligence)")
+    parser.add_argument("--features", default="", help="comma-separated analysis features (default: every feature of the tier)")
+    parser.add_argument("--vi-rate", type=float, default=0, help="Video Intelligence requests per minute (0 = unlimited)")
+    parser.add_argument("--gemini-rate", type=float, default=0, help="Gemini requests per minute (0 = unlimited)")
+    parser.add_argument("--vision-rate", type=float, default=0, help="Cloud Vision requests per minute (0 = unlimited)")
+    parser.add_argument("--checkpoint", default="ingest_checkpoint.json", help="checkpoint file used to resume")
+    parser.add_argument("--retry-failed", action="store_true", help="analyse videos that failed in an earlier run again")
+    parser.add_argument("--skip-analysis", action="store_true", help="only list and insert the videos")
+    args = parser.parse_args()
+
+    features = [feature.strip() for feature in args.features.split(",") if feature.strip()]
+    unknown = [feature for feature in features if feature not in ANALYSIS_FEATURES]
+    if unknown:
+        parser.error(f"unknown features: {', '.join(unknown)}")
+
+    if args.vi_rate:
+        main2.video_intelligence_limiter = RateLimiter(args.vi_rate)
+    if args.gemini_rate:
+        main2.gemini_limiter = RateLimiter(args.gemini_rate)
+    if args.vision_rate:
+        main2.vision_limiter = RateLimiter(args.vision_rate)
+
+    checkpoint = Checkpoint(args.checkpoint, args.prefix)
+    checkpoint.load()
+    try:
+        if args.retry_failed:
+            async with SessionLocal() as db:
+                rows = (await db.execute(select(Video.video_id, Video.s3_url).where(Video.video_id.in_(list(checkpoint.failed))))).all()
+            checkpoint.pending.update(dict(rows))
+            checkpoint.failed = {}
+
+        await ingest(args.prefix, args.page_size, args.workers, args.flush_size, features or None, args.tier, checkpoint, args.skip_analysis)
+    finally:
+        await close_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
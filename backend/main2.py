@@ -1,88 +1,488 @@
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, AsyncExitStack
 from fastapi import FastAPI
-import requests
-from sqlalchemy import create_engine, Column, Integer, String, Float, JSON, Boolean
+import httpx
+from sqlalchemy import Column, Integer, BigInteger, String, Float, JSON, Boolean, DateTime, Index, select, update, delete, bindparam, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import aliased, deferred, undefer_group
 from fastapi import Depends
-from sqlalchemy.orm import Session
-from fastapi import UploadFile, File, Form, Request, HTTPException
-import boto3
+from fastapi import UploadFile, File, Form, Request, Response, Query, HTTPException
 import uuid
-from google.cloud import vision, videointelligence
 import os
-from google import genai
-from elasticsearch import Elasticsearch
+from cachetools import TTLCache
+import hashlib
 import json
+import math
+import base64
+import asyncio
+import re
+import subprocess
+import tempfile
+from datetime import datetime, timedelta, timezone
+from dataclasses import dataclass
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+import redis.asyncio as redis
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+import time
+from pydantic import BaseModel
 from dotenv import load_dotenv
 
+# OpenTelemetry is optional; spans are only recorded when it is installed and OTEL_TRACING=true
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
 load_dotenv()
 
-# Initialize Elasticsearch client
-es = Elasticsearch(
-    os.getenv("ELASTICSEARCH_URL"),
-    basic_auth=(os.getenv("ELASTICSEARCH_USERNAME"), os.getenv("ELASTICSEARCH_PASSWORD")), # type: ignore
-    verify_certs=False
-)
+# Per-stage timings exported on /metrics. Each stage of the upload, analysis, search and
+# callback paths (S3 transfers, Video Intelligence, Gemini, DB commits, ES writes) runs
+# inside `with timed("<stage>"):`.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+stage_seconds = Histogram("cliptag_stage_seconds", "Time spent in each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS)
+stage_errors = Counter("cliptag_stage_errors_total", "Pipeline stages that raised", ["stage"])
+es_outbox_rejected = Counter("cliptag_es_outbox_rejected_total", "Search documents Elasticsearch rejected and the outbox dropped")
+http_request_seconds = Histogram("cliptag_http_request_seconds", "HTTP request latency by route", ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+tracer = trace.get_tracer("cliptag") if trace is not None and os.getenv("OTEL_TRACING", "false").lower() == "true" else None
+
+class timed:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.span = None
+
+    def __enter__(self):
+        if tracer is not None:
+            self.span = tracer.start_as_current_span(self.stage)
+            self.span.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_seconds.labels(self.stage).observe(time.perf_counter() - self.started)
+        if exc_type is not None:
+            stage_errors.labels(self.stage).inc()
+        if self.span is not None:
+            self.span.__exit__(exc_type, exc, tb)
+        return False
+
+# Connection settings for the external services, read from the environment on first use
+@dataclass(frozen=True)
+class Settings:
+    database_url: str
+    elasticsearch_url: str
+    elasticsearch_username: str
+    elasticsearch_password: str
+    aws_region: str
+    aws_access_key_id: str
+    aws_secret_access_key: str
+    google_api_key: str
+    # Connection pool sizes, per worker process
+    es_max_connections: int = 25
+    s3_max_pool_connections: int = 50
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    readiness_timeout: float = 2.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            database_url=os.getenv("DATABASE_URL"),
+            elasticsearch_url=os.getenv("ELASTICSEARCH_URL"),
+            elasticsearch_username=os.getenv("ELASTICSEARCH_USERNAME"),
+            elasticsearch_password=os.getenv("ELASTICSEARCH_PASSWORD"),
+            aws_region=os.getenv("AWS_REGION"),
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            google_api_key=os.getenv("GOOGLE_API_KEY"),
+            es_max_connections=int(os.getenv("ES_MAX_CONNECTIONS", "25")),
+            s3_max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50")),
+            db_pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            readiness_timeout=float(os.getenv("READINESS_TIMEOUT", "2")),
+        )
+
+settings = None
+
+def get_settings():
+    global settings
+    if settings is None:
+        settings = Settings.from_env()
+    return settings
 
-# Initialize S3 client
-s3_client = boto3.client(
-    's3', 
-    region_name=os.getenv("AWS_REGION"),
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
-)
 bucket_name = os.getenv("AWS_BUCKET_NAME")
 
-# Initialize the database
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Uploads land in the VOD source bucket, which triggers the MediaConvert workflow
+SOURCE_BUCKET = "aws-vod-1-source71e471f1-rgfsfngoq2jv"
+SOURCE_BUCKET_URL = f"https://{SOURCE_BUCKET}.s3.amazonaws.com"
+
+# Multipart upload tuning; parts are sent concurrently
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", str(16 * 1024 * 1024)))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "8"))
+UPLOAD_URL_EXPIRATION = int(os.getenv("UPLOAD_URL_EXPIRATION", "3600"))
+
+# /upload lands files under a staging key first (no video suffix, so the transcoding trigger
+# ignores it) and hashes them on the way; in dedup mode an identical file resolves to the
+# existing video instead of being copied into place and processed again
+UPLOAD_DEDUP = os.getenv("UPLOAD_DEDUP", "true").lower() == "true"
+UPLOAD_STAGING_BUCKET = os.getenv("UPLOAD_STAGING_BUCKET", SOURCE_BUCKET)
+UPLOAD_STAGING_PREFIX = os.getenv("UPLOAD_STAGING_PREFIX", "incoming")
+UPLOAD_DEDUP_WAIT = float(os.getenv("UPLOAD_DEDUP_WAIT", "60"))  # seconds to wait for an identical upload still being copied
+
+# Large videos are streamed from S3 into a GCS staging bucket and annotated by URI;
+# only files up to INLINE_CONTENT_MAX_BYTES are sent inline with the request
+GCS_STAGING_BUCKET = os.getenv("GCS_STAGING_BUCKET")
+GCS_STAGING_PREFIX = os.getenv("GCS_STAGING_PREFIX", "clip-tag-staging")
+INLINE_CONTENT_MAX_BYTES = int(os.getenv("INLINE_CONTENT_MAX_BYTES", str(32 * 1024 * 1024)))
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024  # must be a multiple of 256 KiB for GCS resumable uploads
+
+# DATABASE_URL stays a plain postgresql:// URL (Alembic uses it as is); the app runs it on asyncpg
+def async_database_url(url: str):
+    url = make_url(url)
+    if url.drivername in ("postgresql", "postgres", "postgresql+psycopg2"):
+        url = url.set(drivername="postgresql+asyncpg")
+    elif url.drivername == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url
+
+# Clients are created on first use, not at import, so importing this module (app workers,
+# scripts, Alembic) does no I/O and needs no credentials. Every getter also works as a FastAPI
+# dependency; to inject a different client, assign the module global or use app.dependency_overrides.
+es = None
+s3_client = None
+s3_client_stack = AsyncExitStack()
+s3_client_lock = asyncio.Lock()
+engine = None
+genAiClient = None
+video_intelligence_client = None
+vision_client = None
+gcs_client = None
+transfer_config = None
+keyframe_pool = None
+
+def get_es():
+    global es
+    if es is None:
+        from elasticsearch import AsyncElasticsearch
+        config = get_settings()
+        es = AsyncElasticsearch(
+            config.elasticsearch_url,
+            basic_auth=(config.elasticsearch_username, config.elasticsearch_password), # type: ignore
+            verify_certs=False,
+            connections_per_node=config.es_max_connections
+        )
+    return es
+
+async def get_s3_client():
+    global s3_client
+    if s3_client is None:
+        async with s3_client_lock:
+            if s3_client is None:
+                import aioboto3
+                from aiobotocore.config import AioConfig
+                config = get_settings()
+                session = aioboto3.Session(
+                    region_name=config.aws_region,
+                    aws_access_key_id=config.aws_access_key_id,
+                    aws_secret_access_key=config.aws_secret_access_key
+                )
+                s3_client = await s3_client_stack.enter_async_context(
+                    session.client("s3", config=AioConfig(max_pool_connections=config.s3_max_pool_connections))
+                )
+    return s3_client
+
+def get_transfer_config():
+    global transfer_config
+    if transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+        # Parts read ahead of the uploaders wait in an in-memory queue (100 parts by default); keeping
+        # it at UPLOAD_CONCURRENCY bounds an upload to about twice that many parts in RAM
+        transfer_config = TransferConfig(
+            multipart_threshold=UPLOAD_PART_SIZE,
+            multipart_chunksize=UPLOAD_PART_SIZE,
+            max_concurrency=UPLOAD_CONCURRENCY,
+            max_io_queue=UPLOAD_CONCURRENCY
+        )
+    return transfer_config
+
+def get_engine():
+    global engine
+    if engine is None:
+        config = get_settings()
+        if not config.database_url:
+            raise RuntimeError("DATABASE_URL is not set")
+        engine = create_async_engine(
+            async_database_url(config.database_url),
+            pool_size=config.db_pool_size,
+            max_overflow=config.db_max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=1800
+        )
+    return engine
+
+# Binds to get_engine() when the first session is opened
+class LazySessionMaker(async_sessionmaker):
+    def __call__(self, **local_kw):
+        bind = get_engine()
+        if self.kw.get("bind") is not bind:
+            self.configure(bind=bind)
+        return super().__call__(**local_kw)
+
+def get_genai_client():
+    global genAiClient
+    if genAiClient is None:
+        from google import genai
+        genAiClient = genai.Client(api_key=get_settings().google_api_key)
+    return genAiClient
+
+def get_video_intelligence_client():
+    global video_intelligence_client
+    if video_intelligence_client is None:
+        from google.cloud import videointelligence
+        video_intelligence_client = videointelligence.VideoIntelligenceServiceAsyncClient()
+    return video_intelligence_client
+
+def get_vision_client():
+    global vision_client
+    if vision_client is None:
+        from google.cloud import vision
+        vision_client = vision.ImageAnnotatorAsyncClient()
+    return vision_client
+
+# Keyframe extraction decodes video, so it runs in worker processes rather than on the event loop.
+# Spawned workers import this module again, which is cheap now that it does no I/O at import.
+def get_keyframe_pool():
+    global keyframe_pool
+    if keyframe_pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        keyframe_pool = ProcessPoolExecutor(max_workers=KEYFRAME_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return keyframe_pool
+
+def get_gcs_client():
+    global gcs_client
+    if gcs_client is None:
+        from google.cloud import storage
+        gcs_client = storage.Client()
+    return gcs_client
+
+async def close_clients():
+    global es, s3_client, engine, keyframe_pool
+    if es is not None:
+        await es.close()
+        es = None
+    await s3_client_stack.aclose()
+    s3_client = None
+    if engine is not None:
+        await engine.dispose()
+        engine = None
+    if keyframe_pool is not None:
+        keyframe_pool.shutdown(wait=False, cancel_futures=True)
+        keyframe_pool = None
+    if shared_cache is not None:
+        await shared_cache.aclose()
+
+SessionLocal = LazySessionMaker(expire_on_commit=False, autoflush=False)
 Base = declarative_base()
 
+# The API always reads and writes through the alias; the concrete index behind it is versioned
+# (videos_v1, videos_v2, ...) so reindex.py can rebuild it and swap the alias without downtime
+# Related videos are found by approximate kNN over an embedding of each video's tags, AI title and
+# description and transcript. EMBEDDING_BACKEND picks the embedder: "gemini" (the API client already
+# used for titles), "local" (a sentence-transformers model, installed separately) or "hashing"
+# (feature hashing of the words, no model; for local runs and benchmarks). EMBEDDING_DIMS is part of
+# the index mapping, so changing it needs a reindex.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+EMBEDDING_DIMS = int(os.getenv("EMBEDDING_DIMS", "768"))
+EMBEDDING_MAX_CHARS = int(os.getenv("EMBEDDING_MAX_CHARS", "8000"))
+
+ES_INDEX_ALIAS = "videos"
+VIDEOS_INDEX_MAPPING = {
+    "properties": {
+        "video_id": {"type": "keyword"},
+        "title": {"type": "text"},
+        "description": {"type": "text"},
+        "tags": {"type": "keyword"},
+        "explicit_content": {"type": "nested"},
+        "explicit_content_detected": {"type": "boolean"},
+        "transcription": {"type": "text"},
+        "ai_generated_title": {"type": "text"},
+        "ai_generated_description": {"type": "text"},
+        "s3_url": {"type": "keyword"},
+        "embedding": {"type": "dense_vector", "dims": EMBEDDING_DIMS, "index": True, "similarity": "cosine"}
+    }
+}
+
+def versioned_index_name(version: int):
+    return f"{ES_INDEX_ALIAS}_v{version}"
+
 # Create the Elasticsearch index
-def create_index():
-    index_name = "videos"
-    if not es.indices.exists(index=index_name):
-        es.indices.create(index=index_name, body={
-            "mappings": {
-                "properties": {
-                    "video_id": {"type": "keyword"},
-                    "title": {"type": "text"},
-                    "description": {"type": "text"},
-                    "tags": {"type": "keyword"},
-                    "explicit_content": {"type": "nested"},
-                    "transcription": {"type": "text"},
-                    "ai_generated_title": {"type": "text"},
-                    "ai_generated_description": {"type": "text"},
-                    "s3_url": {"type": "keyword"}
-                }
-            }
-        })
-        print(f"Index '{index_name}' created.")
+async def create_index():
+    es = get_es()
+    if await es.indices.exists_alias(name=ES_INDEX_ALIAS):
+        # New fields can be added in place; anything else needs reindex.py
+        await es.indices.put_mapping(index=ES_INDEX_ALIAS, body=VIDEOS_INDEX_MAPPING)
+        print(f"Index alias '{ES_INDEX_ALIAS}' already exists.")
+    elif await es.indices.exists(index=ES_INDEX_ALIAS):
+        print(f"Index '{ES_INDEX_ALIAS}' is not behind an alias yet. Run reindex.py to migrate it.")
     else:
-        print(f"Index '{index_name}' already exists.")
+        index_name = versioned_index_name(1)
+        await es.indices.create(index=index_name, body={
+            "mappings": VIDEOS_INDEX_MAPPING,
+            "aliases": {ES_INDEX_ALIAS: {}}
+        })
+        print(f"Index '{index_name}' created behind alias '{ES_INDEX_ALIAS}'.")
 
-def generate_presigned_url(bucket_name, object_key, expiration=3600):
-    url = s3_client.generate_presigned_url(
+async def generate_presigned_url(bucket_name, object_key, expiration=3600):
+    s3_client = await get_s3_client()
+    url = await s3_client.generate_presigned_url(
         'get_object',
         Params={'Bucket': bucket_name, 'Key': object_key},
         ExpiresIn=expiration
     )
     return url
 
-# Initialize the Google API client
-genAiClient = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+# Client-side throttles for the external APIs, in requests per minute (0 = unlimited).
+# Each acquire() reserves the next free slot, so concurrent callers are spaced out evenly.
+class RateLimiter:
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.next_slot = 0.0
 
-def generate_title_description(transcription: str, tags: list):
-    title = genAiClient.models.generate_content(
-        model="gemini-2.0-flash", contents=f"Generate a concise title for a video about {transcription} with tags {', '.join(tags)}. Give only the title directly without any additional information."
-    )
-    description = genAiClient.models.generate_content(
-        model="gemini-2.0-flash", contents=f"Generate a description for a video about {transcription} with tags {', '.join(tags)}. Give only the description directly without any additional information. It should be a brief summary of the video content. Each tag should be used in the description."
-    )
-    return title.text, description.text
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+video_intelligence_limiter = RateLimiter(float(os.getenv("VIDEO_INTELLIGENCE_RATE_LIMIT", "0")))
+gemini_limiter = RateLimiter(float(os.getenv("GEMINI_RATE_LIMIT", "0")))
+vision_limiter = RateLimiter(float(os.getenv("VISION_RATE_LIMIT", "0")))
+
+GEMINI_MODEL = "gemini-2.0-flash"
+TITLE_DESCRIPTION_PROMPT = (
+    "Generate a concise title and a description for a video about {transcription} with tags {tags}. "
+    "The title should be given directly without any additional information. "
+    "The description should be a brief summary of the video content and each tag should be used in it."
+)
+
+class TitleDescription(BaseModel):
+    title: str
+    description: str
+
+# Content-addressed cache of generated titles/descriptions, so re-analysis and duplicate uploads skip Gemini
+GEMINI_CACHE_SIZE = int(os.getenv("GEMINI_CACHE_SIZE", "10000"))
+GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", str(7 * 24 * 3600)))
+title_description_cache = TTLCache(maxsize=GEMINI_CACHE_SIZE, ttl=GEMINI_CACHE_TTL)
+title_description_cache_stats = {"hits": 0, "misses": 0}
+
+def title_description_cache_key(transcription: str, tags: list):
+    key = json.dumps([GEMINI_MODEL, TITLE_DESCRIPTION_PROMPT, transcription, sorted(tags)])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+# Title and description come back from a single structured (JSON schema) request
+async def generate_title_description(transcription: str, tags: list):
+    cache_key = title_description_cache_key(transcription, tags)
+    cached = title_description_cache.get(cache_key)
+    if cached is not None:
+        title_description_cache_stats["hits"] += 1
+        return cached
+    title_description_cache_stats["misses"] += 1
+
+    from google.genai import types as genai_types
+
+    await gemini_limiter.acquire()
+    with timed("gemini"):
+        response = await get_genai_client().aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=TITLE_DESCRIPTION_PROMPT.format(transcription=transcription, tags=", ".join(sorted(tags))),
+            config=genai_types.GenerateContentConfig(response_mime_type="application/json", response_schema=TitleDescription)
+        )
+    generated = response.parsed
+    if generated is None:
+        generated = TitleDescription.model_validate_json(response.text)
+
+    title_description_cache[cache_key] = (generated.title, generated.description)
+    return generated.title, generated.description
+
+# Every embedder has `async embed(text) -> list[float]` returning EMBEDDING_DIMS values
+class GeminiEmbedder:
+    def __init__(self, model: str, dims: int):
+        self.model = model
+        self.dims = dims
+
+    async def embed(self, text: str):
+        from google.genai import types as genai_types
+
+        await gemini_limiter.acquire()
+        with timed("embedding"):
+            response = await get_genai_client().aio.models.embed_content(
+                model=self.model,
+                contents=text,
+                config=genai_types.EmbedContentConfig(task_type="SEMANTIC_SIMILARITY", output_dimensionality=self.dims)
+            )
+        return response.embeddings[0].values
+
+class LocalEmbedder:
+    def __init__(self, model: str, dims: int):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model)
+        if self.model.get_sentence_embedding_dimension() != dims:
+            raise ValueError(f"{model} produces {self.model.get_sentence_embedding_dimension()} dimensions, EMBEDDING_DIMS is {dims}")
+
+    async def embed(self, text: str):
+        with timed("embedding"):
+            vector = await asyncio.to_thread(self.model.encode, text, normalize_embeddings=True)
+        return vector.tolist()
+
+class HashingEmbedder:
+    def __init__(self, dims: int):
+        self.dims = dims
+
+    async def embed(self, text: str):
+        vector = [0.0] * self.dims
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dims] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+# Created on first use like the other clients; assign `embedder` to plug in another one
+embedder = None
+
+def get_embedder():
+    global embedder
+    if embedder is None:
+        if EMBEDDING_BACKEND == "gemini":
+            embedder = GeminiEmbedder(EMBEDDING_MODEL or "text-embedding-004", EMBEDDING_DIMS)
+        elif EMBEDDING_BACKEND == "local":
+            embedder = LocalEmbedder(EMBEDDING_MODEL or "all-MiniLM-L6-v2", EMBEDDING_DIMS)
+        elif EMBEDDING_BACKEND == "hashing":
+            embedder = HashingEmbedder(EMBEDDING_DIMS)
+        else:
+            raise ValueError(f"Unknown EMBEDDING_BACKEND: {EMBEDDING_BACKEND}")
+    return embedder
+
+def embedding_text(tags=None, ai_generated_title=None, ai_generated_description=None, transcription=None):
+    parts = [ai_generated_title, ai_generated_description, ", ".join(tags or []), transcription]
+    return "\n".join(part for part in parts if part)[:EMBEDDING_MAX_CHARS]
+
+# Video Intelligence likelihoods as severities, so moderation can be sorted in SQL
+LIKELIHOOD_SEVERITY = {
+    "LIKELIHOOD_UNSPECIFIED": 0,
+    "VERY_UNLIKELY": 1,
+    "UNLIKELY": 2,
+    "POSSIBLE": 3,
+    "LIKELY": 4,
+    "VERY_LIKELY": 5,
+}
+FLAGGED_LIKELIHOODS = ["LIKELY", "VERY_LIKELY"]
 
 class Video(Base):
     __tablename__ = "videos"
@@ -91,103 +491,1212 @@ class Video(Base):
     s3_url = Column(String(500), nullable=False)
     duration = Column(Float, nullable=False)
     tags = Column(JSON)
-    explicit_content = Column(JSON, nullable=True)
+    # The large text/JSON columns are only loaded when asked for (undefer_group("details"))
+    explicit_content = deferred(Column(JSON, nullable=True), group="details")
     explicit_content_detected = Column(Boolean, nullable=True)
-    transcription = Column(String, nullable=True)
+    transcription = deferred(Column(String, nullable=True), group="details")
     streaming_url = Column(String, nullable=True)
     title = Column(String, nullable=True)
     description = Column(String, nullable=True)
     ai_generated_title = Column(String, nullable=True)
-    ai_generated_description = Column(String, nullable=True)
-
-def analyze_video(video_id: str, s3_url: str, db: Session):
-    # Analyze video using Google Video Intelligence API
-    response = requests.get(s3_url)
-    if response.status_code != 200:
-        raise Exception(f"Failed to download video. HTTP Status Code: {response.status_code}")
-
-    input_content = response.content
-    video_client = videointelligence.VideoIntelligenceServiceClient()
-    features = [
-        videointelligence.Feature.LABEL_DETECTION,
-        videointelligence.Feature.EXPLICIT_CONTENT_DETECTION,
-        videointelligence.Feature.SPEECH_TRANSCRIPTION
-    ]
-    config = videointelligence.SpeechTranscriptionConfig(
-    language_code="en-US", enable_automatic_punctuation=True
+    ai_generated_description = deferred(Column(String, nullable=True), group="details")
+    # Moderation summary, precomputed at analysis time (see LIKELIHOOD_SEVERITY)
+    explicit_max_likelihood = Column(Integer, nullable=True)
+    explicit_flagged_frames = Column(Integer, nullable=True)
+    # sha256 of the uploaded bytes; identical re-uploads resolve to this row
+    content_hash = Column(String(64), unique=True, index=True, nullable=True)
+    # Set while /upload copies the file into place; dedup only resolves to finished uploads
+    upload_pending = Column(Boolean, nullable=True)
+    # Related-videos embedding, kept here so a reindex can restore it (undefer_group("embedding"))
+    embedding = deferred(Column(JSON, nullable=True), group="embedding")
+
+    # The moderation queue only ever reads flagged rows, sorted by severity
+    __table_args__ = (
+        Index(
+            "ix_videos_moderation_queue",
+            "explicit_max_likelihood",
+            "explicit_flagged_frames",
+            "id",
+            postgresql_where=explicit_content_detected == True,
+            sqlite_where=explicit_content_detected == True,
+        ),
+    )
+
+# Elasticsearch document for a video row (the details and embedding groups must be loaded)
+def video_document(video: Video):
+    document = {
+        "video_id": video.video_id,
+        "title": video.title,
+        "description": video.description,
+        "tags": video.tags or [],
+        "explicit_content": video.explicit_content or [],
+        "explicit_content_detected": video.explicit_content_detected,
+        "transcription": video.transcription or "",
+        "ai_generated_title": video.ai_generated_title or "",
+        "ai_generated_description": video.ai_generated_description or "",
+        "s3_url": f"{SOURCE_BUCKET_URL}/{video.s3_url}"
+    }
+    if video.embedding:
+        document["embedding"] = video.embedding
+    return document
+
+# Analysis jobs are persisted so queued work survives restarts and is shared by every worker process
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(100), unique=True, index=True, nullable=False)
+    video_id = Column(String(100), index=True, nullable=False)
+    status = Column(String(20), index=True, nullable=False, default="queued")
+    progress = Column(String(50), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    result = Column(JSON, nullable=True)
+    features = Column(JSON, nullable=True)  # None means every feature
+    force = Column(Boolean, nullable=False, default=False)  # ignore stored annotation results
+    tier = Column(String(10), nullable=True)  # None means ANALYSIS_DEFAULT_TIER
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), index=True, nullable=False)
+
+    # At most one running and one queued job per video: repeat /analyze calls are merged into the
+    # queued one, which waits for the running one to finish (see claim_next_job)
+    __table_args__ = (
+        Index(
+            "ix_analysis_jobs_running_video_id",
+            "video_id",
+            unique=True,
+            postgresql_where=status == "running",
+            sqlite_where=status == "running",
+        ),
+        Index(
+            "ix_analysis_jobs_queued_video_id",
+            "video_id",
+            unique=True,
+            postgresql_where=status == "queued",
+            sqlite_where=status == "queued",
+        ),
+    )
+
+# Video Intelligence (or keyframe Vision) output per feature, normalized and keyed by the S3 ETag of
+# the file it came from, so re-analysing an unchanged video reuses it instead of calling the API again
+class AnnotationResult(Base):
+    __tablename__ = "annotation_results"
+    id = Column(Integer, primary_key=True, index=True)
+    video_id = Column(String(100), nullable=False)
+    content_hash = Column(String(100), nullable=False)
+    feature = Column(String(50), nullable=False)
+    result = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_annotation_results_lookup", "video_id", "content_hash", "feature", unique=True),
     )
-    video_context = videointelligence.VideoContext(speech_transcription_config=config)
 
-    operation = video_client.annotate_video(request={"features": features, "input_content": input_content, "video_context": video_context})
+# Read-through cache for GET /videos/{video_id}: a per-process LRU with TTL, optionally backed by Redis
+# (REDIS_URL) so every worker shares entries and hears about invalidations. Each write to a video
+# calls invalidate_video_cache after its commit.
+VIDEO_CACHE_SIZE = int(os.getenv("VIDEO_CACHE_SIZE", "10000"))
+VIDEO_CACHE_TTL = int(os.getenv("VIDEO_CACHE_TTL", "300"))
+VIDEO_CACHE_CHANNEL = "video-cache-invalidations"
+REDIS_URL = os.getenv("REDIS_URL")
+shared_cache = redis.from_url(REDIS_URL) if REDIS_URL else None
+video_cache = TTLCache(maxsize=VIDEO_CACHE_SIZE, ttl=VIDEO_CACHE_TTL)
+# Related videos per video, evicted together with the video entry (e.g. when analysis rewrites the
+# embedding); lists that merely contain a changed video age out after RELATED_CACHE_TTL
+RELATED_CACHE_TTL = int(os.getenv("RELATED_CACHE_TTL", "600"))
+related_cache = TTLCache(maxsize=VIDEO_CACHE_SIZE, ttl=RELATED_CACHE_TTL)
+video_cache_stats = {"hits": 0, "misses": 0}
+# Bumped on every invalidation, so a DB read that raced a write doesn't put the stale row back
+video_cache_generation = 0
+
+def serialize_video(video: Video):
+    return {"video_id": video.video_id, "s3_url": f"{SOURCE_BUCKET_URL}/{video.s3_url}", "title": video.title, "description": video.description, "tags": video.tags, "explicit_content": video.explicit_content, "transcription": video.transcription, "ai_generated_title": video.ai_generated_title, "ai_generated_description": video.ai_generated_description, "streaming_url": video.streaming_url, "explicit_content_detected": video.explicit_content_detected}
+
+def video_etag(payload: dict):
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+def video_cache_key(video_id: str):
+    return f"video:{video_id}"
+
+# Returns (etag, payload), or None if the video doesn't exist
+async def get_cached_video(db: AsyncSession, video_id: str):
+    entry = video_cache.get(video_id)
+    if entry is not None:
+        video_cache_stats["hits"] += 1
+        return entry
 
-    result = operation.result(timeout=300)
+    if shared_cache is not None:
+        try:
+            cached = await shared_cache.get(video_cache_key(video_id))
+        except Exception as e:
+            print(f"Shared cache read failed: {e}")
+            cached = None
+        if cached is not None:
+            entry = tuple(json.loads(cached))
+            video_cache[video_id] = entry
+            video_cache_stats["hits"] += 1
+            return entry
+
+    video_cache_stats["misses"] += 1
+    generation = video_cache_generation
+    video = await db.scalar(select(Video).options(undefer_group("details")).where(Video.video_id == video_id))
+    if video is None:
+        return None
+
+    payload = serialize_video(video)
+    entry = (video_etag(payload), payload)
+    if generation == video_cache_generation:
+        video_cache[video_id] = entry
+        if shared_cache is not None:
+            try:
+                await shared_cache.set(video_cache_key(video_id), json.dumps(entry), ex=VIDEO_CACHE_TTL)
+            except Exception as e:
+                print(f"Shared cache write failed: {e}")
+    return entry
+
+def evict_cached_video(video_id: str):
+    global video_cache_generation
+    video_cache_generation += 1
+    video_cache.pop(video_id, None)
+    related_cache.pop(video_id, None)
+
+async def invalidate_video_cache(video_id: str):
+    evict_cached_video(video_id)
+    if shared_cache is not None:
+        try:
+            await shared_cache.delete(video_cache_key(video_id))
+            await shared_cache.publish(VIDEO_CACHE_CHANNEL, video_id)
+        except Exception as e:
+            print(f"Shared cache invalidation failed for {video_id}: {e}")
+
+# Evict entries other workers invalidated
+async def video_cache_invalidation_listener():
+    while True:
+        try:
+            async with shared_cache.pubsub() as pubsub:
+                await pubsub.subscribe(VIDEO_CACHE_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        evict_cached_video(message["data"].decode("utf-8"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Video cache invalidation listener failed: {e}")
+            await asyncio.sleep(1)
+
+# In-process pub/sub for per-video status events (transcode-complete, analysis-progress,
+# analysis-complete, analysis-failed), fanned out to every /videos/{video_id}/events subscriber.
+# A slow subscriber loses its oldest events rather than holding up the publisher.
+class EventHub:
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.subscribers = {}
+
+    def subscribe(self, video_id: str):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(video_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, video_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(video_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[video_id]
+
+    def publish(self, video_id: str, event: str, data: dict):
+        for queue in self.subscribers.get(video_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+
+video_events = EventHub()
+VIDEO_EVENTS_CHANNEL = "video-events"
+SSE_HEARTBEAT_INTERVAL = 15
+
+# With Redis configured, events go through it so subscribers on every worker receive them;
+# each worker's relay (including this one's) hands them to its local hub
+async def publish_video_event(video_id: str, event: str, data: dict):
+    if shared_cache is None:
+        video_events.publish(video_id, event, data)
+        return
+    try:
+        await shared_cache.publish(VIDEO_EVENTS_CHANNEL, json.dumps({"video_id": video_id, "event": event, "data": data}))
+    except Exception as e:
+        print(f"Could not publish {event} for {video_id}: {e}")
+        video_events.publish(video_id, event, data)
+
+async def video_events_relay():
+    while True:
+        try:
+            async with shared_cache.pubsub() as pubsub:
+                await pubsub.subscribe(VIDEO_EVENTS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        payload = json.loads(message["data"])
+                        video_events.publish(payload["video_id"], payload["event"], payload["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Video events relay failed: {e}")
+            await asyncio.sleep(1)
+
+def format_sse(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# Elasticsearch writes go through this outbox, written in the same transaction as the Video change.
+# es_outbox_relay drains it in bulk, merging every pending entry for a video into one partial doc.
+class EsOutbox(Base):
+    __tablename__ = "es_outbox"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    video_id = Column(String(100), nullable=False)
+    document = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+ES_OUTBOX_BATCH_SIZE = int(os.getenv("ES_OUTBOX_BATCH_SIZE", "500"))
+ES_OUTBOX_POLL_INTERVAL = float(os.getenv("ES_OUTBOX_POLL_INTERVAL", "1"))
+es_outbox_ready = asyncio.Event()
+# PostgreSQL advisory lock reindex.py holds to pause the relay while it rebuilds the index
+ES_RELAY_LOCK_KEY = 72710428
+
+# Stage a partial ES document; it is only sent once the caller commits
+def queue_es_document(db: AsyncSession, video_id: str, document: dict):
+    db.add(EsOutbox(video_id=video_id, document=document, created_at=utcnow()))
+
+# Wake the relay after a commit instead of waiting for the next poll
+def notify_es_outbox():
+    es_outbox_ready.set()
+
+# MediaConvert SNS notifications are stored here before they are acknowledged, so a restart or
+# crash can't lose one; sns_inbox_relay applies them in batches and deletes them in the same commit.
+class SnsInbox(Base):
+    __tablename__ = "sns_inbox"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    message_id = Column(String(100), unique=True, index=True, nullable=True)
+    notification = Column(JSON, nullable=False)
+    received_at = Column(DateTime(timezone=True), nullable=False)
+
+# Analysis queue settings
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))
+ANALYSIS_RETRY_BACKOFF = float(os.getenv("ANALYSIS_RETRY_BACKOFF", "30"))  # seconds, doubled on every retry
+ANALYSIS_JOB_LEASE = float(os.getenv("ANALYSIS_JOB_LEASE", "900"))  # running jobs not updated for this long are reclaimed
+ANALYSIS_HEARTBEAT_INTERVAL = ANALYSIS_JOB_LEASE / 3  # how often a running job renews its lease
+ANALYSIS_POLL_INTERVAL = float(os.getenv("ANALYSIS_POLL_INTERVAL", "1"))
+
+# Stream the S3 object into the GCS staging bucket chunk by chunk, so memory use stays at
+# a couple of chunks regardless of file size. Only files up to INLINE_CONTENT_MAX_BYTES are read
+# into memory and sent inline; larger ones are refused when there is no staging bucket.
+# The GCS client is blocking, so each chunk upload is handed to a thread.
+async def stage_video_input(s3_key: str):
+    s3_client = await get_s3_client()
+    s3_object = await s3_client.get_object(Bucket=bucket_name, Key=s3_key)
+    size = s3_object["ContentLength"]
+
+    # Entering the body yields the raw aiohttp response; reads go through the StreamingBody itself
+    body = s3_object["Body"]
+    async with body:
+        if size <= INLINE_CONTENT_MAX_BYTES:
+            return {"input_content": await body.read()}, None
+        if not GCS_STAGING_BUCKET:
+            raise ValueError(f"{s3_key} is {size} bytes, over INLINE_CONTENT_MAX_BYTES; set GCS_STAGING_BUCKET to analyse it")
+
+        blob = get_gcs_client().bucket(GCS_STAGING_BUCKET).blob(f"{GCS_STAGING_PREFIX}/{s3_key}")
+        staged_file = blob.open("wb", chunk_size=STREAM_CHUNK_SIZE)
+        async for chunk in body.iter_chunks(chunk_size=STREAM_CHUNK_SIZE):
+            await asyncio.to_thread(staged_file.write, chunk)
+    await asyncio.to_thread(staged_file.close)
+
+    return {"input_uri": f"gs://{GCS_STAGING_BUCKET}/{blob.name}"}, blob
+
+async def no_progress(stage: str):
+    pass
+
+# Long videos are annotated as separate time segments of the same staged file, several at a
+# time, instead of one operation over the whole video. Set ANALYSIS_SEGMENT_SECONDS=0 to turn it off.
+ANALYSIS_SEGMENT_SECONDS = int(os.getenv("ANALYSIS_SEGMENT_SECONDS", "300"))
+ANALYSIS_SEGMENT_CONCURRENCY = int(os.getenv("ANALYSIS_SEGMENT_CONCURRENCY", "4"))
+ANALYSIS_SEGMENT_TIMEOUT = int(os.getenv("ANALYSIS_SEGMENT_TIMEOUT", "300"))
+
+# Features /analyze can be asked for. The Video Intelligence ones are stored per content hash;
+# "metadata" is the Gemini title and description, generated from the labels and the transcript.
+VIDEO_INTELLIGENCE_FEATURES = {
+    "labels": "LABEL_DETECTION",
+    "explicit_content": "EXPLICIT_CONTENT_DETECTION",
+    "transcription": "SPEECH_TRANSCRIPTION"
+}
+ANALYSIS_FEATURES = [*VIDEO_INTELLIGENCE_FEATURES, "metadata"]
+
+# The "fast" tier takes labels and explicit content from scene-change keyframes annotated by
+# Cloud Vision, which returns in seconds; "full" runs Video Intelligence over the whole video.
+# Transcription needs the audio, so it always goes through Video Intelligence. Without an
+# explicit feature list the fast tier skips it and titles are generated from the labels alone.
+ANALYSIS_TIERS = ["fast", "full"]
+ANALYSIS_DEFAULT_TIER = os.getenv("ANALYSIS_DEFAULT_TIER", "fast")
+KEYFRAME_FEATURES = ["labels", "explicit_content"]
+FAST_TIER_FEATURES = [*KEYFRAME_FEATURES, "metadata"]
+
+KEYFRAME_WORKERS = int(os.getenv("KEYFRAME_WORKERS", "2"))
+KEYFRAME_SCENE_THRESHOLD = float(os.getenv("KEYFRAME_SCENE_THRESHOLD", "0.3"))
+KEYFRAME_MAX_FRAMES = int(os.getenv("KEYFRAME_MAX_FRAMES", "64"))
+KEYFRAME_WIDTH = int(os.getenv("KEYFRAME_WIDTH", "640"))
+KEYFRAME_HASH_DISTANCE = int(os.getenv("KEYFRAME_HASH_DISTANCE", "6"))  # frames closer than this (bits of 64) are duplicates
+KEYFRAME_TIMEOUT = int(os.getenv("KEYFRAME_TIMEOUT", "120"))
+KEYFRAME_MAX_TAGS = int(os.getenv("KEYFRAME_MAX_TAGS", "20"))
+VISION_BATCH_SIZE = 16  # images per batch_annotate_images request, the API maximum
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", "4"))
+VISION_MAX_LABELS = int(os.getenv("VISION_MAX_LABELS", "15"))
+
+# Features an analysis runs when none are given
+def resolve_features(features, tier: str):
+    return features or (FAST_TIER_FEATURES if tier == "fast" else ANALYSIS_FEATURES)
+
+# Stored fast-tier results are kept apart from the full ones; a full result also serves a fast request
+def annotation_key(feature: str, tier: str):
+    return feature if tier == "full" else f"{feature}:{tier}"
+
+# ffprobe only reads the container headers (with range requests), not the whole file.
+# Returns None when ffprobe is missing or fails, which keeps the video in a single segment.
+async def probe_duration(s3_key: str):
+    url = await generate_presigned_url(bucket_name, s3_key, expiration=600)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", url,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout=30)
+        except asyncio.TimeoutError:
+            process.kill()
+            raise
+        return float(stdout.decode().strip())
+    except Exception as e:
+        print(f"Could not probe the duration of {s3_key}: {e}")
+        return None
+
+def video_segments(duration, segment_seconds: int):
+    if not duration or segment_seconds <= 0 or duration <= segment_seconds:
+        return [None]
+    segments = []
+    start = 0
+    while start < duration:
+        segments.append((start, min(start + segment_seconds, duration)))
+        start += segment_seconds
+    return segments
+
+async def annotate_segment(video_input: dict, segment, features: list):
+    from google.cloud import videointelligence
+
+    video_client = get_video_intelligence_client()
+    video_context = videointelligence.VideoContext()
+    if "transcription" in features:
+        video_context.speech_transcription_config = videointelligence.SpeechTranscriptionConfig(
+        language_code="en-US", enable_automatic_punctuation=True
+        )
+    if segment is not None:
+        start, end = segment
+        video_context.segments = [videointelligence.VideoSegment(
+            start_time_offset=timedelta(seconds=start), end_time_offset=timedelta(seconds=end)
+        )]
+
+    request = {"features": [videointelligence.Feature[VIDEO_INTELLIGENCE_FEATURES[feature]] for feature in features], "video_context": video_context, **video_input}
+    await video_intelligence_limiter.acquire()
+    with timed("video_intelligence"):
+        operation = await video_client.annotate_video(request=request)
+        result = await operation.result(timeout=ANALYSIS_SEGMENT_TIMEOUT)
+    return result.annotation_results[0]
+
+# Annotate every segment with at most ANALYSIS_SEGMENT_CONCURRENCY operations in flight.
+# Results come back in segment order; `annotate` can be swapped for a fake when testing locally.
+async def annotate_segments(video_input: dict, segments: list, features: list, annotate=annotate_segment):
+    semaphore = asyncio.Semaphore(ANALYSIS_SEGMENT_CONCURRENCY)
+
+    async def run(segment):
+        async with semaphore:
+            return await annotate(video_input, segment, features)
+
+    return await asyncio.gather(*[run(segment) for segment in segments])
+
+# Merge per-segment results in order into one JSON-serializable result per feature. Frame time
+# offsets from the API are already relative to the start of the video, so they are used as they are.
+def merge_annotations(annotation_results: list, features: list):
+    from google.cloud import videointelligence
 
-    # Extract labels
     labels = []
-    for annotation in result.annotation_results[0].segment_label_annotations:
-        labels.append(annotation.entity.description)
-
-    # Extract explicit content detection results
-    explicit_content = []
-    for frame in result.annotation_results[0].explicit_annotation.frames:
-        if frame.pornography_likelihood in ["LIKELY", "VERY_LIKELY"]:
-            explicit_content.append({
+    frames = []
+    transcripts = []
+    for annotation_result in annotation_results:
+        for annotation in annotation_result.segment_label_annotations:
+            if annotation.entity.description not in labels:
+                labels.append(annotation.entity.description)
+        for frame in annotation_result.explicit_annotation.frames:
+            frames.append({
                 "time_offset": frame.time_offset.seconds + frame.time_offset.microseconds / 1e6,
-                "likelihood": frame.pornography_likelihood
+                "likelihood": videointelligence.Likelihood(frame.pornography_likelihood).name
             })
-    
-    # update explicit content detected flag
-    video = db.query(Video).filter(Video.video_id == video_id).first()
-    if len(explicit_content) > 0:       
-        if video:
-            video.explicit_content_detected = True
-            db.commit()
-    else:
-        if video:
-            video.explicit_content_detected = False
-            db.commit()
+        for speech_transcription in annotation_result.speech_transcriptions:
+            for alternative in speech_transcription.alternatives:
+                transcripts.append(alternative.transcript)
+    frames.sort(key=lambda frame: frame["time_offset"])
+    merged = {"labels": labels, "explicit_content": frames, "transcription": transcripts}
+    return {feature: merged[feature] for feature in features}
 
-    transcription = ""
-    for speech_transcription in result.annotation_results[0].speech_transcriptions:
-        for alternative in speech_transcription.alternatives:
-            transcription += alternative.transcript + " "
+# 64-bit difference hash: one bit per horizontally adjacent pixel pair of a 9x8 grayscale thumbnail
+def difference_hash(image):
+    pixels = list(image.convert("L").resize((9, 8)).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = bits << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
 
-    # Generate title and description
-    title, description = generate_title_description(transcription, labels)
+# Runs in a keyframe pool worker. ffmpeg keeps the first frame and every scene change (scaled down),
+# showinfo reports their timestamps, and frames whose hash is within max_distance of one already
+# kept are dropped. Returns [(time_offset, jpeg_bytes)] in video order.
+def extract_keyframes(url: str, scene_threshold: float, max_frames: int, width: int, max_distance: int, timeout: float):
+    import io
+    from PIL import Image
 
-    # Update video metadata in PostgreSQL
-    video = db.query(Video).filter(Video.video_id == video_id).first()
-
-    if video:
-        video.tags = labels  # Ensure labels is JSON-serializable
-        video.explicit_content = explicit_content
-        video.transcription = transcription.strip()
-        video.ai_generated_title = title
-        video.ai_generated_description = description
-        db.commit()
-    else:
-        raise ValueError(f"Video with ID {video_id} not found.")
+    with tempfile.TemporaryDirectory() as workdir:
+        process = subprocess.run([
+            "ffmpeg", "-nostdin", "-v", "info", "-i", url,
+            "-vf", f"select='eq(n,0)+gt(scene,{scene_threshold})',showinfo,scale={width}:-2",
+            "-vsync", "vfr", "-frames:v", str(max_frames), "-q:v", "4",
+            os.path.join(workdir, "%04d.jpg")
+        ], capture_output=True, text=True, timeout=timeout)
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {process.stderr.strip().splitlines()[-1:]}")
 
-    return {"ai_generated_title": title, "ai_generated_description": description, "tags": labels, "explicit_content": explicit_content, "transcription": transcription.strip(), "title": video.title, "description": video.description}
+        time_offsets = [float(value) for value in re.findall(r"pts_time:\s*([\d.]+)", process.stderr)]
+        keyframes = []
+        hashes = []
+        for index, name in enumerate(sorted(os.listdir(workdir))):
+            with open(os.path.join(workdir, name), "rb") as f:
+                content = f.read()
+            frame_hash = difference_hash(Image.open(io.BytesIO(content)))
+            if any((frame_hash ^ kept).bit_count() <= max_distance for kept in hashes):
+                continue
+            hashes.append(frame_hash)
+            keyframes.append((time_offsets[index] if index < len(time_offsets) else None, content))
+    return keyframes
 
-# Create the database tables
-Base.metadata.create_all(bind=engine)
+async def sample_keyframes(s3_key: str):
+    url = await generate_presigned_url(bucket_name, s3_key, expiration=600)
+    with timed("keyframes"):
+        keyframes = await asyncio.get_running_loop().run_in_executor(
+            get_keyframe_pool(), extract_keyframes,
+            url, KEYFRAME_SCENE_THRESHOLD, KEYFRAME_MAX_FRAMES, KEYFRAME_WIDTH, KEYFRAME_HASH_DISTANCE, KEYFRAME_TIMEOUT
+        )
+    if not keyframes:
+        raise ValueError(f"No keyframes could be extracted from {s3_key}")
+    return keyframes
 
-# Dependency to get the database session
-def get_db():
-    db = SessionLocal()
+# Annotate keyframes VISION_BATCH_SIZE at a time, with up to VISION_CONCURRENCY batches in flight.
+# Returns [(time_offset, AnnotateImageResponse)] in keyframe order.
+async def annotate_keyframes(keyframes: list, features: list):
+    from google.cloud import vision
+
+    requested = []
+    if "labels" in features:
+        requested.append(vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION, max_results=VISION_MAX_LABELS))
+    if "explicit_content" in features:
+        requested.append(vision.Feature(type_=vision.Feature.Type.SAFE_SEARCH_DETECTION))
+
+    client = get_vision_client()
+    semaphore = asyncio.Semaphore(VISION_CONCURRENCY)
+
+    async def run(batch):
+        async with semaphore:
+            await vision_limiter.acquire()
+            with timed("vision"):
+                response = await client.batch_annotate_images(requests=[
+                    vision.AnnotateImageRequest(image=vision.Image(content=content), features=requested) for _, content in batch
+                ])
+        return list(zip([time_offset for time_offset, _ in batch], response.responses))
+
+    batches = [keyframes[i:i + VISION_BATCH_SIZE] for i in range(0, len(keyframes), VISION_BATCH_SIZE)]
+    return [item for batch in await asyncio.gather(*[run(batch) for batch in batches]) for item in batch]
+
+# Labels are ranked by how many keyframes they appear on (best score breaks ties); the adult
+# safe-search likelihood of every keyframe becomes an explicit content frame, in the same shape
+# merge_annotations produces
+def merge_keyframe_annotations(annotated: list, features: list):
+    from google.cloud import vision
+
+    counts = {}
+    scores = {}
+    frames = []
+    for time_offset, response in annotated:
+        if response.error.message:
+            print(f"Vision could not annotate the keyframe at {time_offset}s: {response.error.message}")
+            continue
+        for annotation in response.label_annotations:
+            counts[annotation.description] = counts.get(annotation.description, 0) + 1
+            scores[annotation.description] = max(scores.get(annotation.description, 0), annotation.score)
+        if "explicit_content" in features:
+            frames.append({
+                "time_offset": time_offset,
+                "likelihood": vision.Likelihood(response.safe_search_annotation.adult).name
+            })
+    labels = sorted(counts, key=lambda label: (-counts[label], -scores[label]))[:KEYFRAME_MAX_TAGS]
+    merged = {"labels": labels, "explicit_content": frames}
+    return {feature: merged[feature] for feature in features}
+
+async def load_annotation_results(db: AsyncSession, video_id: str, content_hash: str, features: set):
+    rows = (await db.scalars(
+        select(AnnotationResult).where(
+            AnnotationResult.video_id == video_id,
+            AnnotationResult.content_hash == content_hash,
+            AnnotationResult.feature.in_(features)
+        )
+    )).all()
+    return {row.feature: row.result for row in rows}
+
+async def store_annotation_results(db: AsyncSession, video_id: str, content_hash: str, results: dict):
+    await db.execute(delete(AnnotationResult).where(
+        AnnotationResult.video_id == video_id,
+        AnnotationResult.content_hash == content_hash,
+        AnnotationResult.feature.in_(list(results))
+    ))
+    now = utcnow()
+    db.add_all([
+        AnnotationResult(video_id=video_id, content_hash=content_hash, feature=feature, result=result, created_at=now)
+        for feature, result in results.items()
+    ])
+    with timed("db_commit"):
+        await db.commit()
+
+# Everything one analysis run produced, assembled before anything is written. Fields stay None
+# for features that were not requested, and persisting only touches the columns that are set.
+@dataclass(frozen=True)
+class AnalysisResult:
+    video_id: str
+    features: tuple
+    reused_features: tuple
+    tier: str = "full"
+    tags: tuple = None
+    explicit_frames: tuple = None  # every annotated frame, flagged or not
+    transcription: str = None
+    ai_generated_title: str = None
+    ai_generated_description: str = None
+    embedding: tuple = None  # () clears the stored embedding
+
+    # Column values for the Video row
+    def values(self):
+        values = {}
+        if self.tags is not None:
+            values["tags"] = list(self.tags)
+        if self.explicit_frames is not None:
+            explicit_content = [dict(frame) for frame in self.explicit_frames if frame["likelihood"] in FLAGGED_LIKELIHOODS]
+            values["explicit_content"] = explicit_content
+            values["explicit_content_detected"] = len(explicit_content) > 0
+            values["explicit_max_likelihood"] = max((LIKELIHOOD_SEVERITY.get(frame["likelihood"], 0) for frame in self.explicit_frames), default=0)
+            values["explicit_flagged_frames"] = len(explicit_content)
+        if self.transcription is not None:
+            values["transcription"] = self.transcription
+        if self.ai_generated_title is not None:
+            values["ai_generated_title"] = self.ai_generated_title
+            values["ai_generated_description"] = self.ai_generated_description
+        if self.embedding is not None:
+            # null unsets the search field too, so related videos never come from a stale vector
+            values["embedding"] = list(self.embedding) or None
+        return values
+
+    # Partial search document with the same fields (the moderation summary is not indexed)
+    def document(self):
+        document = self.values()
+        document.pop("explicit_max_likelihood", None)
+        document.pop("explicit_flagged_frames", None)
+        return document
+
+    def response(self):
+        response = {"tier": self.tier, "features": list(self.features), "reused_features": list(self.reused_features)}
+        response.update(self.document())
+        response.pop("explicit_content_detected", None)
+        response.pop("embedding", None)
+        return response
+
+# Columns the related-videos embedding is built from
+EMBEDDED_COLUMNS = ("tags", "ai_generated_title", "ai_generated_description", "transcription")
+
+# Embed the video as it will read once this analysis is written: the new fields over the stored ones.
+# An embedder failure only costs the related-videos entry, so it does not fail the analysis; like
+# text with nothing to embed, it returns () so the embedding of the old text is cleared.
+async def compute_embedding(db: AsyncSession, video_id: str, fields: dict):
+    row = (await db.execute(
+        select(*[getattr(Video, column) for column in EMBEDDED_COLUMNS]).where(Video.video_id == video_id)
+    )).first()
+    values = row._asdict() if row else {}
+    values.update({column: value for column, value in fields.items() if column in EMBEDDED_COLUMNS})
+    text = embedding_text(**values)
+    if not text:
+        return ()
     try:
+        vector = await get_embedder().embed(text)
+    except Exception as e:
+        print(f"Could not embed {video_id}: {e}")
+        return ()
+    # Cosine similarity is undefined for the zero vector, which ES rejects
+    return tuple(vector) if any(vector) else ()
+
+# Run the requested analysis and return the result without touching the Video row. Annotation
+# results are still stored as they come in, so a failure further on (e.g. Gemini) does not lose them.
+async def compute_analysis(video_id: str, s3_key: str, db: AsyncSession, on_progress=no_progress, features=None, force: bool = False, tier: str = None):
+    tier = tier or ANALYSIS_DEFAULT_TIER
+    features = resolve_features(features, tier)
+    needed = {feature for feature in features if feature in VIDEO_INTELLIGENCE_FEATURES}
+    if "metadata" in features:
+        needed |= {"labels", "transcription"} if tier == "full" else {"labels"}
+    from_keyframes = {feature for feature in needed if feature in KEYFRAME_FEATURES} if tier == "fast" else set()
+
+    # The ETag changes whenever the object is rewritten, so it identifies the analysed content
+    head = await (await get_s3_client()).head_object(Bucket=bucket_name, Key=s3_key)
+    content_hash = head["ETag"].strip('"')
+    results = {}
+    if not force:
+        keys = needed | {annotation_key(feature, tier) for feature in from_keyframes}
+        stored = await load_annotation_results(db, video_id, content_hash, keys)
+        for feature in needed:
+            key = feature if feature in stored else annotation_key(feature, tier)
+            if key in stored:
+                results[feature] = stored[key]
+    reused = sorted(results)
+    missing_keyframe = [feature for feature in KEYFRAME_FEATURES if feature in from_keyframes and feature not in results]
+    missing = [feature for feature in VIDEO_INTELLIGENCE_FEATURES if feature in needed and feature not in results and feature not in from_keyframes]
+
+    if missing_keyframe:
+        await on_progress("sampling_keyframes")
+        keyframes = await sample_keyframes(s3_key)
+        await on_progress("annotating_keyframes")
+        computed = merge_keyframe_annotations(await annotate_keyframes(keyframes, missing_keyframe), missing_keyframe)
+        await store_annotation_results(db, video_id, content_hash, {annotation_key(feature, tier): result for feature, result in computed.items()})
+        results.update(computed)
+
+    if missing:
+        # Analyze video using Google Video Intelligence API
+        await on_progress("downloading")
+        with timed("s3_download"):
+            video_input, staged_blob = await stage_video_input(s3_key)
+
+        try:
+            # Segmenting only pays off for staged files; inline content would be resent with every segment
+            segments = [None]
+            if staged_blob is not None and ANALYSIS_SEGMENT_SECONDS > 0:
+                with timed("ffprobe"):
+                    segments = video_segments(await probe_duration(s3_key), ANALYSIS_SEGMENT_SECONDS)
+
+            await on_progress("annotating")
+            annotation_results = await annotate_segments(video_input, segments, missing)
+        finally:
+            del video_input
+            if staged_blob is not None:
+                try:
+                    await asyncio.to_thread(staged_blob.delete)
+                except Exception as e:
+                    print(f"Could not delete staged video {staged_blob.name}: {e}")
+
+        computed = merge_annotations(annotation_results, missing)
+        await store_annotation_results(db, video_id, content_hash, computed)
+        results.update(computed)
+
+    labels = results.get("labels", [])
+    transcription = " ".join(results.get("transcription", [])).strip()
+    fields = {}
+    if "labels" in features:
+        fields["tags"] = tuple(labels)
+    if "explicit_content" in features:
+        fields["explicit_frames"] = tuple(results["explicit_content"])
+    if "transcription" in features:
+        fields["transcription"] = transcription
+    if "metadata" in features:
+        # Generate title and description
+        await on_progress("generating_metadata")
+        fields["ai_generated_title"], fields["ai_generated_description"] = await generate_title_description(transcription, labels)
+
+    # An explicit-content-only pass leaves the embedded text as it was, so the stored embedding stands
+    if any(column in fields for column in EMBEDDED_COLUMNS):
+        fields["embedding"] = await compute_embedding(db, video_id, fields)
+
+    return AnalysisResult(video_id=video_id, features=tuple(features), reused_features=tuple(reused), tier=tier, **fields)
+
+# Write one result with a single UPDATE ... WHERE video_id (no ORM load), together with its
+# search document in the same transaction
+async def persist_analysis_result(db: AsyncSession, result: AnalysisResult):
+    row = (await db.execute(
+        update(Video)
+        .where(Video.video_id == result.video_id)
+        .values(**result.values())
+        .returning(Video.title, Video.description)
+        .execution_options(synchronize_session=False)
+    )).first()
+    if row is None:
+        await db.rollback()
+        raise ValueError(f"Video with ID {result.video_id} not found.")
+
+    queue_es_document(db, result.video_id, result.document())
+    with timed("db_commit"):
+        await db.commit()
+    notify_es_outbox()
+    await invalidate_video_cache(result.video_id)
+    return row
+
+# Bulk variant for batch workers: many results per transaction, one executemany UPDATE for each
+# distinct set of columns
+async def persist_analysis_results(db: AsyncSession, results: list):
+    table = Video.__table__
+    groups = {}
+    for result in results:
+        groups.setdefault(tuple(sorted(result.values())), []).append(result)
+
+    for columns, group in groups.items():
+        statement = (
+            update(table)
+            .where(table.c.video_id == bindparam("target_video_id"))
+            .values({column: bindparam(f"value_{column}", type_=table.c[column].type) for column in columns})
+        )
+        params = []
+        for result in group:
+            values = result.values()
+            params.append({"target_video_id": result.video_id, **{f"value_{column}": values[column] for column in columns}})
+            queue_es_document(db, result.video_id, result.document())
+        await db.execute(statement, params)
+
+    with timed("db_commit"):
+        await db.commit()
+    notify_es_outbox()
+    for result in results:
+        await invalidate_video_cache(result.video_id)
+
+async def analyze_video(video_id: str, s3_key: str, db: AsyncSession, on_progress=no_progress, features=None, force: bool = False, tier: str = None):
+    result = await compute_analysis(video_id, s3_key, db, on_progress=on_progress, features=features, force=force, tier=tier)
+
+    # Update video metadata in PostgreSQL
+    title, description = await persist_analysis_result(db, result)
+    return {**result.response(), "title": title, "description": description}
+
+# Dependency to get the database session
+async def get_db():
+    async with SessionLocal() as db:
         yield db
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+def serialize_job(job: AnalysisJob):
+    return {
+        "job_id": job.job_id,
+        "video_id": job.video_id,
+        "status": job.status,
+        "progress": job.progress,
+        "attempts": job.attempts,
+        "tier": job.tier or ANALYSIS_DEFAULT_TIER,
+        "features": job.features,
+        "error": job.error,
+        "result": job.result,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+# A job that has not started yet picks up the extra features, and a full request upgrades a fast one.
+# Returns whether anything changed.
+def merge_job_request(job: AnalysisJob, features, force: bool, tier: str):
+    merged = None if features is None or job.features is None else sorted(set(job.features) | set(features))
+    merged_tier = "full" if "full" in (job.tier, tier) else job.tier
+    if merged == job.features and (job.force or not force) and merged_tier == job.tier:
+        return False
+    job.features = merged
+    job.force = job.force or force
+    job.tier = merged_tier
+    return True
+
+# Whether a job already running does everything the request asks for
+def job_covers_request(job: AnalysisJob, features, force: bool, tier: str):
+    job_tier = job.tier or ANALYSIS_DEFAULT_TIER
+    if (force and not job.force) or (tier == "full" and job_tier != "full"):
+        return False
+    return set(resolve_features(features, tier)) <= set(resolve_features(job.features, job_tier))
+
+# Queue an analysis job. Requests for a video that is already queued are merged into that job. While a
+# job is running, a request it covers returns it; anything more is queued as a follow-up that runs next.
+async def enqueue_analysis_job(db: AsyncSession, video_id: str, features=None, force: bool = False, tier: str = None):
+    tier = tier or ANALYSIS_DEFAULT_TIER
+    queued = await db.scalar(select(AnalysisJob).where(AnalysisJob.video_id == video_id, AnalysisJob.status == "queued"))
+    if queued:
+        if merge_job_request(queued, features, force, tier):
+            await db.commit()
+        return queued
+    running = await db.scalar(select(AnalysisJob).where(AnalysisJob.video_id == video_id, AnalysisJob.status == "running"))
+    if running and job_covers_request(running, features, force, tier):
+        return running
+
+    now = utcnow()
+    job = AnalysisJob(job_id=str(uuid.uuid4()), video_id=video_id, status="queued", progress="queued", attempts=0, features=features, force=force, tier=tier, created_at=now, updated_at=now, next_attempt_at=now)
+    db.add(job)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Another request queued the same video concurrently; merge into its job instead
+        await db.rollback()
+        return await enqueue_analysis_job(db, video_id, features=features, force=force, tier=tier)
+    return job
+
+# With `attempt`, only the worker that claimed that attempt can update the job; returns False once the
+# job was reclaimed by another worker (or is no longer running)
+async def update_job(db: AsyncSession, job_id: str, attempt: int = None, **values):
+    values["updated_at"] = utcnow()
+    statement = update(AnalysisJob).where(AnalysisJob.job_id == job_id)
+    if attempt is not None:
+        statement = statement.where(AnalysisJob.attempts == attempt, AnalysisJob.status == "running")
+    result = await db.execute(statement.values(**values))
+    await db.commit()
+    return result.rowcount > 0
+
+# Renew the lease of a running job while it works, so a long analysis (many segments) isn't reclaimed
+# and run a second time. Returns when the lease turns out to belong to another worker.
+async def job_heartbeat(job_id: str, attempt: int):
+    while True:
+        await asyncio.sleep(ANALYSIS_HEARTBEAT_INTERVAL)
+        try:
+            async with SessionLocal() as db:
+                if not await update_job(db, job_id, attempt=attempt):
+                    return
+        except Exception as e:
+            print(f"Could not renew the lease of analysis job {job_id}: {e}")
+
+# Claim the next due job; SKIP LOCKED lets several processes share the queue without double-claiming.
+# A queued job waits while another job for the same video is running.
+async def claim_next_job():
+    async with SessionLocal() as db:
+        now = utcnow()
+        stale = now - timedelta(seconds=ANALYSIS_JOB_LEASE)
+        running = aliased(AnalysisJob)
+        video_busy = select(running.id).where(running.video_id == AnalysisJob.video_id, running.status == "running").exists()
+        candidates = (await db.execute(
+            select(AnalysisJob.id, AnalysisJob.job_id, AnalysisJob.video_id, AnalysisJob.status, AnalysisJob.attempts)
+            .where(
+                ((AnalysisJob.status == "queued") & (AnalysisJob.next_attempt_at <= now) & ~video_busy)
+                | ((AnalysisJob.status == "running") & (AnalysisJob.updated_at < stale))
+            )
+            .order_by(AnalysisJob.next_attempt_at)
+            .limit(ANALYSIS_WORKERS + 1)
+            .with_for_update(skip_locked=True)
+        )).all()
+
+        # SKIP LOCKED keeps PostgreSQL workers apart, but SQLite has no row locks: the claim only
+        # counts if the job is still as it was read, so of several workers reading it only one wins
+        for candidate in candidates:
+            statement = (
+                update(AnalysisJob)
+                .where(AnalysisJob.id == candidate.id, AnalysisJob.status == candidate.status, AnalysisJob.attempts == candidate.attempts)
+                .values(status="running", progress="starting", attempts=AnalysisJob.attempts + 1, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            if candidate.status == "running":
+                statement = statement.where(AnalysisJob.updated_at < stale)
+            try:
+                result = await db.execute(statement)
+                await db.commit()
+            except IntegrityError:
+                # another job for the same video started running first
+                await db.rollback()
+                continue
+            if result.rowcount > 0:
+                return candidate.job_id, candidate.video_id, candidate.attempts + 1
+        return None
+
+async def run_analysis_job(job_id: str, video_id: str, attempt: int):
+    async with SessionLocal() as db:
+        try:
+            await process_analysis_job(db, job_id, video_id, attempt)
+        except Exception as e:
+            print(f"Analysis job {job_id} failed: {e}")
+            await db.rollback()
+            job = await db.scalar(select(AnalysisJob).where(AnalysisJob.job_id == job_id))
+            if job is None or job.attempts != attempt or job.status != "running":
+                # another worker has taken the job over
+                return
+            request = (job.features, job.force, job.tier)
+            if job.attempts >= ANALYSIS_MAX_ATTEMPTS:
+                await update_job(db, job_id, status="failed", progress="failed", error=str(e))
+                await publish_video_event(video_id, "analysis-failed", {"video_id": video_id, "job_id": job_id, "error": str(e)})
+            elif not await supersede_job(db, job_id, video_id, request, str(e)):
+                delay = ANALYSIS_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+                try:
+                    await update_job(db, job_id, status="queued", progress="retrying", error=str(e), next_attempt_at=utcnow() + timedelta(seconds=delay))
+                except IntegrityError:
+                    # /analyze queued a follow-up for the video in the meantime
+                    await db.rollback()
+                    if not await supersede_job(db, job_id, video_id, request, str(e)):
+                        raise
+                    return
+                await publish_video_event(video_id, "analysis-progress", {"video_id": video_id, "job_id": job_id, "stage": "retrying"})
+
+# Only one job per video can be queued, so a retry is folded into a queued follow-up when there is
+# one. Returns False if there is none.
+async def supersede_job(db: AsyncSession, job_id: str, video_id: str, request: tuple, error: str):
+    follow_up = await db.scalar(select(AnalysisJob).where(AnalysisJob.video_id == video_id, AnalysisJob.status == "queued"))
+    if follow_up is None:
+        return False
+    merge_job_request(follow_up, *request)
+    await db.commit()
+    await update_job(db, job_id, status="failed", progress="superseded", error=error)
+    await publish_video_event(video_id, "analysis-progress", {"video_id": video_id, "job_id": follow_up.job_id, "stage": "retrying"})
+    return True
+
+async def process_analysis_job(db: AsyncSession, job_id: str, video_id: str, attempt: int):
+    video = await db.scalar(select(Video).where(Video.video_id == video_id))
+    if not video:
+        await update_job(db, job_id, attempt=attempt, status="failed", progress="failed", error="Video not found")
+        return
+
+    async def on_progress(stage: str):
+        await update_job(db, job_id, attempt=attempt, progress=stage)
+        await publish_video_event(video_id, "analysis-progress", {"video_id": video_id, "job_id": job_id, "stage": stage})
+
+    job = await db.scalar(select(AnalysisJob).where(AnalysisJob.job_id == job_id))
+    heartbeat = asyncio.create_task(job_heartbeat(job_id, attempt))
+    analysis = asyncio.create_task(analyze_video(video_id, video.s3_url, db, on_progress=on_progress, features=job.features, force=job.force, tier=job.tier))
+    try:
+        with timed("analysis"):
+            await asyncio.wait({heartbeat, analysis}, return_when=asyncio.FIRST_COMPLETED)
     finally:
-        db.close()
+        heartbeat.cancel()
+        if not analysis.done():
+            # the lease was lost, so stop paying for an analysis another worker is repeating
+            analysis.cancel()
+        await asyncio.gather(heartbeat, analysis, return_exceptions=True)
+    if analysis.cancelled():
+        print(f"Analysis job {job_id} was reclaimed by another worker; stopped attempt {attempt}")
+        return
+    analysis_results = analysis.result()
+
+    if not await update_job(db, job_id, attempt=attempt, status="succeeded", progress="done", error=None, result={"video_id": video_id, **analysis_results}):
+        print(f"Analysis job {job_id} was reclaimed by another worker; not marking attempt {attempt} done")
+        return
+    await publish_video_event(video_id, "analysis-complete", {"video_id": video_id, "job_id": job_id, **analysis_results})
+
+# Bulk item statuses worth retrying; any other rejection (a mapping conflict, a vector with the wrong
+# number of dims) fails the same way every time
+ES_RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+# Send one batch of outbox entries to ES. Plain FOR UPDATE (no SKIP LOCKED) serializes relays across
+# processes, so updates for a video are always applied in commit order. If the request fails nothing
+# is deleted and the batch is retried; merged partial updates are idempotent. Documents ES rejects for
+# good are logged and dropped so they don't hold up every write behind them; reindex.py restores them.
+# While reindex.py holds ES_RELAY_LOCK_KEY nothing is drained, so changes wait for the new index.
+async def drain_es_outbox():
+    from elasticsearch.helpers import async_bulk
+
+    async with SessionLocal() as db:
+        if get_engine().dialect.name == "postgresql":
+            if not await db.scalar(text("SELECT pg_try_advisory_xact_lock_shared(:key)"), {"key": ES_RELAY_LOCK_KEY}):
+                return 0
+        entries = (await db.scalars(
+            select(EsOutbox).order_by(EsOutbox.id).limit(ES_OUTBOX_BATCH_SIZE).with_for_update()
+        )).all()
+        if not entries:
+            return 0
+
+        documents = {}
+        for entry in entries:
+            documents.setdefault(entry.video_id, {}).update(entry.document)
+
+        actions = [
+            {"_op_type": "update", "_index": ES_INDEX_ALIAS, "_id": video_id, "doc": document, "doc_as_upsert": True}
+            for video_id, document in documents.items()
+        ]
+        with timed("es_bulk"):
+            _, errors = await async_bulk(get_es(), actions, raise_on_error=False)
 
+        retry = set()
+        for error in errors:
+            item = next(iter(error.values()))
+            if item.get("status") in ES_RETRYABLE_STATUSES:
+                retry.add(item["_id"])
+            else:
+                es_outbox_rejected.inc()
+                print(f"Elasticsearch rejected the update for {item['_id']}: {item.get('error')}")
+
+        done = [entry.id for entry in entries if entry.video_id not in retry]
+        if done:
+            await db.execute(delete(EsOutbox).where(EsOutbox.id.in_(done)))
+        await db.commit()
+        return len(done)
+
+async def es_outbox_relay():
+    while True:
+        try:
+            drained = await drain_es_outbox()
+        except Exception as e:
+            print(f"Elasticsearch outbox relay failed: {e}")
+            drained = 0
+
+        # A full batch means more is probably waiting
+        if drained < ES_OUTBOX_BATCH_SIZE:
+            try:
+                await asyncio.wait_for(es_outbox_ready.wait(), timeout=ES_OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            es_outbox_ready.clear()
+
+# MediaConvert SNS notifications are acknowledged once they are stored in sns_inbox; a relay
+# keeps only the latest streaming_url per video and writes each batch in a single executemany UPDATE
+SNS_FLUSH_BATCH_SIZE = int(os.getenv("SNS_FLUSH_BATCH_SIZE", "500"))
+SNS_FLUSH_INTERVAL = float(os.getenv("SNS_FLUSH_INTERVAL", "0.5"))  # poll for notifications stored by other workers
+SNS_DEDUP_TTL = int(os.getenv("SNS_DEDUP_TTL", "86400"))
+sns_inbox_ready = asyncio.Event()
+seen_sns_messages = TTLCache(maxsize=100000, ttl=SNS_DEDUP_TTL)
+
+# SNS redelivers until it gets a 2xx, so the same MessageId can arrive more than once and,
+# with several workers, on different ones; Redis makes the check shared when configured
+async def claim_sns_message(message_id: str):
+    if message_id in seen_sns_messages:
+        return False
+    if shared_cache is not None:
+        try:
+            if not await shared_cache.set(f"sns:{message_id}", 1, nx=True, ex=SNS_DEDUP_TTL):
+                return False
+        except Exception as e:
+            print(f"Shared SNS dedup failed for {message_id}: {e}")
+    seen_sns_messages[message_id] = True
+    return True
+
+async def release_sns_message(message_id: str):
+    seen_sns_messages.pop(message_id, None)
+    if shared_cache is not None:
+        try:
+            await shared_cache.delete(f"sns:{message_id}")
+        except Exception as e:
+            print(f"Shared SNS dedup release failed for {message_id}: {e}")
+
+def streaming_update_from_notification(notification: dict):
+    message = json.loads(notification["Message"])
+    streaming_url = message.get("Outputs", {}).get("HLS_GROUP", [None])[0]
+    if not streaming_url:
+        return None
+    # the video_id is the file name of the HLS playlist
+    return streaming_url.split("/")[-1].split(".")[0], streaming_url
+
+async def confirm_sns_subscription(subscribe_url: str):
+    async with httpx.AsyncClient() as client:
+        response = await client.get(subscribe_url)
+        response.raise_for_status()
+    print("SNS subscription confirmed")
+
+async def flush_streaming_urls(db: AsyncSession, pending: dict):
+    statement = (
+        update(Video.__table__)
+        .where(Video.__table__.c.video_id == bindparam("target_video_id"))
+        .values(streaming_url=bindparam("target_streaming_url"))
+    )
+    params = [{"target_video_id": video_id, "target_streaming_url": url} for video_id, url in pending.items()]
+    with timed("streaming_url_flush"):
+        await db.execute(statement, params)
+
+# Apply one batch of stored notifications. The streaming URLs and the deletion of the batch commit
+# together, so a failure leaves every notification in place to be retried. Notifications that can't
+# be processed are logged and dropped with the batch.
+async def drain_sns_inbox():
+    async with SessionLocal() as db:
+        entries = (await db.scalars(
+            select(SnsInbox).order_by(SnsInbox.id).limit(SNS_FLUSH_BATCH_SIZE).with_for_update()
+        )).all()
+        if not entries:
+            return 0
+
+        pending = {}
+        for entry in entries:
+            notification = entry.notification
+            try:
+                if notification.get("Type") == "SubscriptionConfirmation":
+                    await confirm_sns_subscription(notification["SubscribeURL"])
+                else:
+                    parsed = streaming_update_from_notification(notification)
+                    if parsed:
+                        video_id, streaming_url = parsed
+                        pending[video_id] = streaming_url
+            except Exception as e:
+                print(f"Error processing notification {entry.message_id}: {e}")
+
+        if pending:
+            await flush_streaming_urls(db, pending)
+        await db.execute(delete(SnsInbox).where(SnsInbox.id.in_([entry.id for entry in entries])))
+        await db.commit()
+
+    for video_id, streaming_url in pending.items():
+        await invalidate_video_cache(video_id)
+        await publish_video_event(video_id, "transcode-complete", {"video_id": video_id, "streaming_url": streaming_url})
+    return len(entries)
+
+async def sns_inbox_relay():
+    while True:
+        try:
+            drained = await drain_sns_inbox()
+        except Exception as e:
+            print(f"Applying MediaConvert notifications failed: {e}")
+            drained = 0
+
+        # A full batch means more is probably waiting
+        if drained < SNS_FLUSH_BATCH_SIZE:
+            try:
+                await asyncio.wait_for(sns_inbox_ready.wait(), timeout=SNS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            sns_inbox_ready.clear()
+
+# Each worker pulls one job at a time and awaits the whole pipeline, leaving the event loop free
+async def analysis_worker(worker_id: int):
+    while True:
+        try:
+            claimed = await claim_next_job()
+        except Exception as e:
+            print(f"Analysis worker {worker_id} could not claim a job: {e}")
+            claimed = None
+
+        if claimed is None:
+            await asyncio.sleep(ANALYSIS_POLL_INTERVAL)
+            continue
+
+        # A failure in the retry bookkeeping (e.g. the database going away) must not stop the worker;
+        # the job's lease runs out and it is claimed again
+        try:
+            await run_analysis_job(*claimed)
+        except Exception as e:
+            print(f"Analysis worker {worker_id} failed on job {claimed[0]}: {e}")
+            await asyncio.sleep(ANALYSIS_POLL_INTERVAL)
+
+# Ensure the Elasticsearch index exists without holding up startup; retried until ES answers
+async def ensure_search_index():
+    delay = 1
+    while True:
+        try:
+            await create_index()
+            return
+        except Exception as e:
+            print(f"Creating the search index failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+# Startup does no I/O: tables come from `alembic upgrade head`, clients connect on first use
+# and the search index is created in the background. /readyz reports when dependencies answer.
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_index()  # Ensure the Elasticsearch index is created
+    workers = [asyncio.create_task(ensure_search_index())]
+    workers += [asyncio.create_task(analysis_worker(i)) for i in range(ANALYSIS_WORKERS)]
+    workers.append(asyncio.create_task(es_outbox_relay()))
+    workers.append(asyncio.create_task(sns_inbox_relay()))
+    if shared_cache is not None:
+        workers.append(asyncio.create_task(video_cache_invalidation_listener()))
+        workers.append(asyncio.create_task(video_events_relay()))
     print("Application startup complete. OK!")
-    
+
     yield
 
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await close_clients()
     print("Application shutdown complete. OK!")
 
 app = FastAPI(lifespan=lifespan)
@@ -199,8 +1708,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# Request latency per route template (not the raw path, so label cardinality stays bounded)
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        http_request_seconds.labels(request.method, route.path if route else "unmatched", str(status)).observe(time.perf_counter() - started)
+
 # Test endpoint
 @app.get("/abx")
 def home2():
@@ -208,170 +1731,549 @@ def home2():
 
 # Test DB endpoint
 @app.get("/test-db")
-def test_db(db: Session = Depends(get_db)):
+async def test_db(db: AsyncSession = Depends(get_db)):
     # Fetch all videos
-    videos = db.query(Video).all()
+    videos = (await db.scalars(select(Video))).all()
     return [{"video_id": v.video_id, "s3_url": v.s3_url, "tags": v.tags} for v in videos]
 
+def video_s3_key(video_id: str):
+    return f"assets01/videos/{video_id}.mp4"
+
+# Save the metadata of a video that is already in S3 and index it for search
+def new_uploaded_video(video_id: str, title: str, description: str, content_hash: str = None, upload_pending: bool = None):
+    return Video(video_id=video_id, s3_url=video_s3_key(video_id), duration=120, title = title, description = description, content_hash=content_hash, upload_pending=upload_pending)
+
+async def register_uploaded_video(db: AsyncSession, video_id: str, title: str, description: str, content_hash: str = None):
+    # Save video metadata to PostgreSQL
+    video = new_uploaded_video(video_id, title, description, content_hash=content_hash)
+    db.add(video)
+    return await index_uploaded_video(db, video_id, video_document(video))
+
+# Index video metadata in Elasticsearch, via the outbox in the same transaction as any pending row changes
+async def index_uploaded_video(db: AsyncSession, video_id: str, document: dict):
+    queue_es_document(db, video_id, document)
+    with timed("db_commit"):
+        await db.commit()
+    notify_es_outbox()
+    await invalidate_video_cache(video_id)
+
+    # streaming_url is filled in later by /mediaconvert-callback; clients can listen for it on
+    # /videos/{video_id}/events instead of polling
+    return {"video_id": video_id, "streaming_url": None}
+
+# Hashes the bytes as upload_fileobj reads them, so dedup needs no second pass over the file
+class HashingReader:
+    def __init__(self, file: UploadFile):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    async def read(self, size: int = -1):
+        chunk = await self.file.read(size)
+        self.sha256.update(chunk)
+        return chunk
+
+# Wait for the identical upload holding the hash to finish its copy. Returns its row, which is still
+# pending if the wait timed out, or None if that upload failed and released the hash.
+async def wait_for_upload(db: AsyncSession, content_hash: str):
+    deadline = time.monotonic() + UPLOAD_DEDUP_WAIT
+    while True:
+        row = (await db.execute(select(Video.id, Video.upload_pending).where(Video.content_hash == content_hash))).first()
+        if row is None:
+            return None
+        if not row.upload_pending or time.monotonic() >= deadline:
+            return await db.scalar(select(Video).where(Video.id == row.id).execution_options(populate_existing=True))
+        # end the read so the next poll sees the other upload's commit
+        await db.rollback()
+        await asyncio.sleep(0.5)
+
+def duplicate_upload_response(video: Video):
+    return {"video_id": video.video_id, "streaming_url": video.streaming_url, "duplicate": True}
+
 # Upload video endpoint
 @app.post("/upload")
-async def upload_video(title : str = Form("Untitled Video") , description: str = Form("N/A"), file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_video(title : str = Form("Untitled Video") , description: str = Form("N/A"), file: UploadFile = File(...), dedup: bool = Form(UPLOAD_DEDUP), db: AsyncSession = Depends(get_db), s3_client = Depends(get_s3_client)):
+    transfer_config = get_transfer_config()
     video_id = str(uuid.uuid4())
-    s3_key = f"assets01/videos/{video_id}.mp4"
+    staging_key = f"{UPLOAD_STAGING_PREFIX}/{video_id}.upload"
+    s3_key = video_s3_key(video_id)
 
-    # Upload to S3
-    s3_client.upload_fileobj(file.file, 'aws-vod-1-source71e471f1-rgfsfngoq2jv', s3_key)
-    s3_url = f"https://aws-vod-1-source71e471f1-rgfsfngoq2jv.s3.amazonaws.com/{s3_key}"
+    # Upload to S3 as a concurrent multipart transfer, hashing the stream as it goes
+    reader = HashingReader(file)
+    with timed("s3_upload"):
+        await s3_client.upload_fileobj(reader, UPLOAD_STAGING_BUCKET, staging_key, Config=transfer_config)
+    content_hash = reader.sha256.hexdigest()
 
-    # Save video metadata to PostgreSQL
-    video = Video(video_id=video_id, s3_url=s3_key, duration=120, title = title, description = description)
-    db.add(video)
-    db.commit()
+    try:
+        existing = await db.scalar(select(Video).where(Video.content_hash == content_hash))
+        if existing and dedup and existing.upload_pending:
+            existing = await wait_for_upload(db, content_hash)
+        if existing and dedup and not existing.upload_pending:
+            return duplicate_upload_response(existing)
+        if existing:
+            # keep the copy; the hash stays with the original
+            content_hash = None
 
-    # wait till the time video streaming url is generated
-    # while True:
-    #     video = db.query(Video).filter(Video.video_id == video_id).first()
-    #     if video.streaming_url:
-    #         break
+        # Reserve the hash before the copy starts transcoding, so of two identical uploads racing
+        # only one pays for MediaConvert. The row is only indexed for search once its file is in place.
+        video = new_uploaded_video(video_id, title, description, content_hash=content_hash, upload_pending=True)
+        document = video_document(video)
+        db.add(video)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # an identical upload reserved it first
+            await db.rollback()
+            owner = await wait_for_upload(db, content_hash) if dedup else None
+            if owner is not None and not owner.upload_pending:
+                return duplicate_upload_response(owner)
+            db.add(new_uploaded_video(video_id, title, description, upload_pending=True))
+            await db.commit()
 
-    # Index video metadata in Elasticsearch
-    es.index(index="videos", id=video_id, body={
-        "video_id": video_id,
-        "title": title,
-        "description": description,
-        "tags": [],
-        "explicit_content": [],
-        "transcription": "",
-        "ai_generated_title": "",
-        "ai_generated_description": "",
-        "s3_url": s3_url
-    })
-
-    return {"video_id": video_id, "streaming_url": video.streaming_url}
-
-@app.post("/analyze/{video_id}")
-async def analyze(video_id: str, db: Session = Depends(get_db)):
-    video = db.query(Video).filter(Video.video_id == video_id).first()
+        # Server-side copy into place, which starts transcoding
+        try:
+            with timed("s3_copy"):
+                await s3_client.copy({"Bucket": UPLOAD_STAGING_BUCKET, "Key": staging_key}, SOURCE_BUCKET, s3_key, Config=transfer_config)
+        except Exception:
+            # release the reservation so the same file can be uploaded again
+            await db.rollback()
+            await db.execute(delete(Video).where(Video.video_id == video_id))
+            await db.commit()
+            raise
+        # the upload counts as done, for dedup too, in the commit that queues its search document
+        await db.execute(update(Video).where(Video.video_id == video_id).values(upload_pending=None).execution_options(synchronize_session=False))
+        return await index_uploaded_video(db, video_id, document)
+    finally:
+        await s3_client.delete_object(Bucket=UPLOAD_STAGING_BUCKET, Key=staging_key)
+
+# Resumable uploads: the client initiates a multipart upload, PUTs each part straight to S3
+# with a presigned URL, and completes it here, so large files never pass through the API server
+class UploadPartsRequest(BaseModel):
+    upload_id: str
+    part_numbers: list[int]
+
+class UploadedPart(BaseModel):
+    part_number: int
+    etag: str
+
+class CompleteUploadRequest(BaseModel):
+    upload_id: str
+    parts: list[UploadedPart]
+    title: str = "Untitled Video"
+    description: str = "N/A"
+
+@app.post("/uploads")
+async def initiate_upload(s3_client = Depends(get_s3_client)):
+    video_id = str(uuid.uuid4())
+    upload = await s3_client.create_multipart_upload(Bucket=SOURCE_BUCKET, Key=video_s3_key(video_id), ContentType="video/mp4")
+    return {"video_id": video_id, "upload_id": upload["UploadId"], "part_size": UPLOAD_PART_SIZE}
+
+@app.post("/uploads/{video_id}/parts")
+async def presign_upload_parts(video_id: str, request: UploadPartsRequest, s3_client = Depends(get_s3_client)):
+    if any(part_number < 1 or part_number > 10000 for part_number in request.part_numbers):
+        raise HTTPException(status_code=400, detail="Part numbers must be between 1 and 10000")
+
+    urls = {}
+    for part_number in request.part_numbers:
+        urls[part_number] = await s3_client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': SOURCE_BUCKET, 'Key': video_s3_key(video_id), 'UploadId': request.upload_id, 'PartNumber': part_number},
+            ExpiresIn=UPLOAD_URL_EXPIRATION
+        )
+    return {"video_id": video_id, "upload_id": request.upload_id, "urls": urls}
+
+# List the parts S3 already has, so an interrupted client can resume where it stopped
+@app.get("/uploads/{video_id}/parts")
+async def list_upload_parts(video_id: str, upload_id: str, s3_client = Depends(get_s3_client)):
+    parts = []
+    paginator = s3_client.get_paginator('list_parts')
+    try:
+        async for page in paginator.paginate(Bucket=SOURCE_BUCKET, Key=video_s3_key(video_id), UploadId=upload_id):
+            for part in page.get("Parts", []):
+                parts.append({"part_number": part["PartNumber"], "etag": part["ETag"], "size": part["Size"]})
+    except s3_client.exceptions.NoSuchUpload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"video_id": video_id, "upload_id": upload_id, "parts": parts}
+
+@app.post("/uploads/{video_id}/complete")
+async def complete_upload(video_id: str, request: CompleteUploadRequest, db: AsyncSession = Depends(get_db), s3_client = Depends(get_s3_client)):
+    parts = sorted(request.parts, key=lambda part: part.part_number)
+    try:
+        await s3_client.complete_multipart_upload(
+            Bucket=SOURCE_BUCKET,
+            Key=video_s3_key(video_id),
+            UploadId=request.upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": part.part_number, "ETag": part.etag} for part in parts]}
+        )
+    except s3_client.exceptions.NoSuchUpload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    return await register_uploaded_video(db, video_id, request.title, request.description)
+
+@app.delete("/uploads/{video_id}")
+async def abort_upload(video_id: str, upload_id: str, s3_client = Depends(get_s3_client)):
+    await s3_client.abort_multipart_upload(Bucket=SOURCE_BUCKET, Key=video_s3_key(video_id), UploadId=upload_id)
+    return {"message": "Upload aborted"}
+
+# Queue a video for analysis; poll /jobs/{job_id} for progress
+@app.post("/analyze/{video_id}", status_code=202)
+async def analyze(video_id: str, features: str = Query(None), force: bool = False, tier: str = Query(None), db: AsyncSession = Depends(get_db)):
+    if tier is not None and tier not in ANALYSIS_TIERS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier: {tier}")
+    requested = None
+    if features:
+        requested = sorted({feature.strip() for feature in features.split(",") if feature.strip()})
+        unknown = [feature for feature in requested if feature not in ANALYSIS_FEATURES]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown features: {', '.join(unknown)}")
+
+    video = await db.scalar(select(Video).where(Video.video_id == video_id))
     if not video:
-        return {"error": "Video not found"}
-
-    presigned_url = generate_presigned_url(bucket_name, video.s3_url)
-
-    analysis_results = analyze_video(video_id, presigned_url, db)
-
-    # Update Elasticsearch index with the analysis results
-    es.update(index="videos", id=video_id, body={
-        "doc": {
-            "ai_generated_title": analysis_results["ai_generated_title"],
-            "ai_generated_description": analysis_results["ai_generated_description"],
-            "tags": analysis_results["tags"],
-            "explicit_content": analysis_results["explicit_content"],
-            "transcription": analysis_results["transcription"],
-            "title": analysis_results["title"],
-            "description": analysis_results["description"]
-        }
-    })
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    job = await enqueue_analysis_job(db, video_id, features=requested, force=force, tier=tier)
+    await publish_video_event(video_id, "analysis-progress", {"video_id": video_id, "job_id": job.job_id, "stage": job.progress})
+    return {"job_id": job.job_id, "video_id": video_id, "status": job.status}
+
+# get the status of an analysis job
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    job = await db.scalar(select(AnalysisJob).where(AnalysisJob.job_id == job_id))
+    if job:
+        return serialize_job(job)
+    else:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+# cache hit/miss counters
+def cache_summary(stats: dict, cache: TTLCache):
+    lookups = stats["hits"] + stats["misses"]
+    return {**stats, "hit_ratio": stats["hits"] / lookups if lookups else None, "size": len(cache)}
+
+# Liveness: the process is up and serving; touches no dependency
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+async def check_database():
+    async with SessionLocal() as db:
+        await db.execute(text("SELECT 1"))
+
+async def check_elasticsearch():
+    if not await get_es().ping():
+        raise RuntimeError("ping failed")
+
+async def check_s3():
+    await (await get_s3_client()).head_bucket(Bucket=SOURCE_BUCKET)
+
+async def check_redis():
+    await shared_cache.ping()
+
+# Readiness: every dependency answers within READINESS_TIMEOUT; 503 lists the ones that don't
+@app.get("/readyz")
+async def readyz():
+    checks = {"database": check_database, "elasticsearch": check_elasticsearch, "s3": check_s3}
+    if shared_cache is not None:
+        checks["redis"] = check_redis
+
+    timeout = get_settings().readiness_timeout
+    results = await asyncio.gather(
+        *[asyncio.wait_for(check(), timeout=timeout) for check in checks.values()],
+        return_exceptions=True
+    )
+    dependencies = {}
+    for name, result in zip(checks, results):
+        if isinstance(result, asyncio.TimeoutError):
+            dependencies[name] = "timeout"
+        elif isinstance(result, Exception):
+            dependencies[name] = f"error: {result}"
+        else:
+            dependencies[name] = "ok"
+
+    ready = all(status == "ok" for status in dependencies.values())
+    return JSONResponse({"status": "ok" if ready else "unavailable", "dependencies": dependencies}, status_code=200 if ready else 503)
+
+# Prometheus scrape endpoint. Under several worker processes, set PROMETHEUS_MULTIPROC_DIR
+# so the samples of every process are aggregated.
+@app.get("/metrics")
+async def metrics():
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/cache/stats")
+def get_cache_stats():
     return {
-        "title": analysis_results["title"],
-        "description": analysis_results["description"],
-        "ai_generated_title": analysis_results["ai_generated_title"],
-        "ai_generated_description": analysis_results["ai_generated_description"],
-        "video_id": video_id,
-        "tags": analysis_results["tags"],
-        "explicit_content": analysis_results["explicit_content"],
-        "transcription": analysis_results["transcription"]
+        "title_description": cache_summary(title_description_cache_stats, title_description_cache),
+        "video": cache_summary(video_cache_stats, video_cache)
     }
 
 # endpoint to fetch videos flagged for moderation
+# Served from the partial moderation index; sort=severity puts the most likely explicit videos first
 @app.get("/moderation")
-def get_moderation_videos(db: Session = Depends(get_db)):
-    videos = db.query(Video).filter(Video.explicit_content != None).all()
-
-    flagged_videos = []
-    for video in videos:
-        for frame in video.explicit_content:
-            if frame["likelihood"] in ["VERY_LIKELY", "LIKELY"]:
-                flagged_videos.append({
-                    "video_id": video.video_id,
-                    "s3_url": f"https://aws-vod-1-source71e471f1-rgfsfngoq2jv.s3.amazonaws.com/{video.s3_url}",
-                    "explicit_content": video.explicit_content
-                })
-                break  # Stop checking further frames for this video
-
-    return flagged_videos
+async def get_moderation_videos(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    sort: str = Query("severity", pattern="^(severity|recent)$"),
+    db: AsyncSession = Depends(get_db)
+):
+    query = select(Video).options(undefer_group("details")).where(Video.explicit_content_detected == True)
+    if sort == "severity":
+        query = query.order_by(Video.explicit_max_likelihood.desc(), Video.explicit_flagged_frames.desc(), Video.id.desc())
+    else:
+        query = query.order_by(Video.id.desc())
+    videos = (await db.scalars(query.offset(offset).limit(limit))).all()
+
+    return [{
+        "video_id": video.video_id,
+        "s3_url": f"{SOURCE_BUCKET_URL}/{video.s3_url}",
+        "explicit_content": video.explicit_content,
+        "max_likelihood": video.explicit_max_likelihood,
+        "flagged_frames": video.explicit_flagged_frames
+    } for video in videos]
+
+# Titles outweigh descriptions, which outweigh the transcript
+SEARCH_FIELD_BOOSTS = {
+    "title": 3,
+    "ai_generated_title": 3,
+    "tags": 2,
+    "description": 1.5,
+    "ai_generated_description": 1.5,
+    "transcription": 1,
+}
+# Only what the results list shows is returned; long fields come back as highlighted snippets
+SEARCH_SOURCE_FIELDS = ["video_id", "title", "ai_generated_title", "description", "tags", "explicit_content_detected"]
+SEARCH_HIGHLIGHT_FIELDS = ["transcription", "description", "ai_generated_description"]
+
+def encode_search_after(sort_values: list):
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode("utf-8")).decode("ascii")
+
+def decode_search_after(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid search_after cursor")
 
 # endpoint to search videos
+# Pass next_search_after from one page as ?search_after= to get the next one
 @app.get("/search")
-def search_videos(query: str):
-    # Search videos using Elasticsearch
-    search_results = es.search(index="videos", body={
+async def search_videos(
+    query: str,
+    size: int = Query(20, ge=1, le=100),
+    search_after: str | None = None,
+    tags: list[str] | None = Query(None),
+    explicit: bool | None = None,
+    es = Depends(get_es)
+):
+    # Filters don't affect scoring, so they go in filter context where ES can cache them
+    filters = []
+    if tags:
+        filters.append({"terms": {"tags": tags}})
+    if explicit is not None:
+        filters.append({"term": {"explicit_content_detected": explicit}})
+
+    body = {
+        "size": size,
+        "track_total_hits": False,
+        "_source": SEARCH_SOURCE_FIELDS,
         "query": {
-            "multi_match": {
-                "query": query,
-                "fields": ["title", "description", "tags", "transcription", "ai_generated_title", "ai_generated_description"]
+            "bool": {
+                "must": {
+                    "multi_match": {
+                        "query": query,
+                        "fields": [f"{field}^{boost}" for field, boost in SEARCH_FIELD_BOOSTS.items()]
+                    }
+                },
+                "filter": filters
             }
+        },
+        "sort": [{"_score": "desc"}, {"video_id": "asc"}],
+        "highlight": {
+            "fields": {field: {"fragment_size": 150, "number_of_fragments": 2} for field in SEARCH_HIGHLIGHT_FIELDS}
         }
-    })
+    }
+    if search_after:
+        body["search_after"] = decode_search_after(search_after)
+
+    # Search videos using Elasticsearch
+    with timed("es_search"):
+        search_results = await es.search(index=ES_INDEX_ALIAS, body=body)
 
-    return {"results": [hit["_source"] for hit in search_results["hits"]["hits"]]}
+    hits = search_results["hits"]["hits"]
+    results = [{**hit["_source"], "score": hit["_score"], "highlights": hit.get("highlight", {})} for hit in hits]
+    next_search_after = encode_search_after(hits[-1]["sort"]) if len(hits) == size else None
+    return {"results": results, "next_search_after": next_search_after}
 
-# list all videos
+# Columns /videos can return; the default leaves out the large text/JSON ones
+VIDEO_LIST_FIELDS = {
+    "video_id": Video.video_id,
+    "s3_url": Video.s3_url,
+    "title": Video.title,
+    "description": Video.description,
+    "tags": Video.tags,
+    "explicit_content": Video.explicit_content,
+    "transcription": Video.transcription,
+    "ai_generated_title": Video.ai_generated_title,
+    "ai_generated_description": Video.ai_generated_description,
+    "streaming_url": Video.streaming_url,
+    "explicit_content_detected": Video.explicit_content_detected,
+}
+DEFAULT_VIDEO_LIST_FIELDS = "video_id,s3_url,title,description,tags,ai_generated_title,streaming_url,explicit_content_detected"
+
+# list videos, newest first, a page at a time
+# Pages are keyset-paginated on id: pass the X-Next-Cursor header of one page as ?cursor= for the next
 @app.get("/videos")
-def list_videos(db: Session = Depends(get_db)):
-    videos = db.query(Video).order_by(Video.id.desc()).all()
+async def list_videos(
+    response: Response,
+    cursor: int | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    fields: str = DEFAULT_VIDEO_LIST_FIELDS,
+    db: AsyncSession = Depends(get_db)
+):
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in VIDEO_LIST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    # Only the requested columns are selected, so the large ones are never read from the table
+    query = select(Video.id, *[VIDEO_LIST_FIELDS[name] for name in names]).order_by(Video.id.desc()).limit(limit + 1)
+    if cursor is not None:
+        query = query.where(Video.id < cursor)
+    rows = (await db.execute(query)).all()
 
-    return [{"video_id": v.video_id, "s3_url": f"https://aws-vod-1-source71e471f1-rgfsfngoq2jv.s3.amazonaws.com/{v.s3_url}", "title": v.title, "description": v.description, "tags": v.tags, "explicit_content": v.explicit_content, "transcription": v.transcription, "ai_generated_title": v.ai_generated_title, "ai_generated_description": v.ai_generated_description, "streaming_url": v.streaming_url, "explicit_content_detected": v.explicit_content_detected} for v in videos]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+
+    videos = []
+    for row in rows:
+        video = {name: getattr(row, name) for name in names}
+        if "s3_url" in video:
+            video["s3_url"] = f"{SOURCE_BUCKET_URL}/{video['s3_url']}"
+        videos.append(video)
+    return videos
 
 # get a specific video
+# Served from the read-through cache; send the ETag back as If-None-Match to get a 304 when nothing changed
 @app.get("/videos/{video_id}")
-def get_video(video_id: str, db: Session = Depends(get_db)):
-    video = db.query(Video).filter(Video.video_id == video_id).first()
-    if video:
-        return {"video_id": video.video_id, "s3_url": f"https://aws-vod-1-source71e471f1-rgfsfngoq2jv.s3.amazonaws.com/{video.s3_url}", "title": video.title, "description": video.description, "tags": video.tags, "explicit_content": video.explicit_content, "transcription": video.transcription, "ai_generated_title": video.ai_generated_title, "ai_generated_description": video.ai_generated_description, "streaming_url": video.streaming_url, "explicit_content_detected": video.explicit_content_detected}
-    else:
+async def get_video(video_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    entry = await get_cached_video(db, video_id)
+    if entry is None:
         raise HTTPException(status_code=404, detail="Video not found")
 
+    etag, payload = entry
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
+# Videos similar to this one by approximate kNN over the embeddings. RELATED_MAX results are fetched
+# and cached per video; `size` slices them.
+RELATED_MAX = int(os.getenv("RELATED_MAX", "50"))
+RELATED_NUM_CANDIDATES = int(os.getenv("RELATED_NUM_CANDIDATES", "200"))
+
+def related_query(video_id: str, vector: list, k: int = RELATED_MAX, num_candidates: int = RELATED_NUM_CANDIDATES):
+    return {
+        "knn": {
+            "field": "embedding",
+            "query_vector": vector,
+            "k": k,
+            "num_candidates": max(num_candidates, k),
+            "filter": {"bool": {"must_not": {"term": {"video_id": video_id}}}}
+        },
+        "size": k,
+        "_source": SEARCH_SOURCE_FIELDS
+    }
+
+async def find_related_videos(es, video_id: str, vector: list):
+    body = related_query(video_id, vector)
+    with timed("es_knn"):
+        search_results = await es.search(index=ES_INDEX_ALIAS, body=body)
+    return [{**hit["_source"], "score": hit["_score"]} for hit in search_results["hits"]["hits"]]
+
+@app.get("/videos/{video_id}/related")
+async def related_videos(video_id: str, size: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_db), es = Depends(get_es)):
+    results = related_cache.get(video_id)
+    if results is None:
+        generation = video_cache_generation
+        video = await db.scalar(select(Video).options(undefer_group("embedding")).where(Video.video_id == video_id))
+        if video is None:
+            raise HTTPException(status_code=404, detail="Video not found")
+        # Not analysed yet (or embedding failed): nothing to compare against
+        results = await find_related_videos(es, video_id, video.embedding) if video.embedding else []
+        if generation == video_cache_generation:
+            related_cache[video_id] = results
+    return {"video_id": video_id, "results": results[:size]}
+
+# Server-sent events for one video: a "status" snapshot on connect, then transcode-complete,
+# analysis-progress, analysis-complete and analysis-failed as they happen
+@app.get("/videos/{video_id}/events")
+async def video_events_stream(video_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    # Subscribe before taking the snapshot so nothing published in between is lost
+    queue = video_events.subscribe(video_id)
+    try:
+        entry = await get_cached_video(db, video_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Video not found")
+        job = await db.scalar(select(AnalysisJob).where(AnalysisJob.video_id == video_id).order_by(AnalysisJob.id.desc()).limit(1))
+    except BaseException:
+        video_events.unsubscribe(video_id, queue)
+        raise
+
+    snapshot = {
+        "video_id": video_id,
+        "streaming_url": entry[1]["streaming_url"],
+        "analysis": serialize_job(job) if job else None
+    }
+
+    async def stream():
+        try:
+            yield format_sse("status", snapshot)
+            while not await request.is_disconnected():
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event, data)
+        finally:
+            video_events.unsubscribe(video_id, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # mediaconvert callback endpoint to update video streaming URL
 # IMPORTANT: This endpoint should be publicly accessible to receive notifications from AWS SNS and subscribe to the SNS topic
 # If running locally, you can use a tool like ngrok to expose your local server to the internet or do port forwarding(in built in VSCode)
 @app.post("/mediaconvert-callback")
-async def mediaconvert_callback(request: Request, db: Session = Depends(get_db)):
+async def mediaconvert_callback(request: Request, db: AsyncSession = Depends(get_db)):
+    # Parse the SNS notification
     try:
-        # Parse the SNS notification
-        body = await request.body()
-        notification = json.loads(body)
-
-        # Confirm the subscription if required
-        if "Type" in notification and notification["Type"] == "SubscriptionConfirmation":
-            # Confirm the subscription by visiting the SubscribeURL
-            import requests
-            requests.get(notification["SubscribeURL"])
-            return {"message": "Subscription confirmed"}
-
-        # Process the notification
-        if "Message" in notification:
-            message = json.loads(notification["Message"])
-
-            # Extract the streaming URL and input file
-            # input_file = message.get("InputFile")
-            streaming_url = message.get("Outputs", {}).get("HLS_GROUP", [None])[0]
-            # extract the video_id from the streaming url
-            video_id = streaming_url.split("/")[-1].split(".")[0]
-
-            if streaming_url:
-                # Extract the video_id from the input file path
-                # video_id = input_file.split("/")[-1].split(".")[0]
-
-                # Update the video record in the database
-                video = db.query(Video).filter(Video.video_id == video_id).first()
-                if video:
-                    video.streaming_url = streaming_url
-                    db.commit()
-                    return {"message": "Video updated successfully"}
-                else:
-                    raise HTTPException(status_code=404, detail="Video not found")
+        notification = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid notification")
+
+    message_id = notification.get("MessageId")
+    if message_id and not await claim_sns_message(message_id):
+        return {"message": "Duplicate notification"}
 
-        return {"message": "Notification processed"}
+    # Acknowledge once the notification is stored; the update happens on the background relay
+    db.add(SnsInbox(message_id=message_id, notification=notification, received_at=utcnow()))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # another worker stored the same MessageId first
+        await db.rollback()
+        return {"message": "Duplicate notification"}
     except Exception as e:
-        print(f"Error processing notification: {e}")
-        raise HTTPException(status_code=500, detail="Error processing notification")
\ No newline at end of file
+        # let SNS retry later instead of dropping the notification
+        print(f"Storing notification {message_id} failed: {e}")
+        await db.rollback()
+        if message_id:
+            await release_sns_message(message_id)
+        raise HTTPException(status_code=503, detail="Could not store the notification")
+    sns_inbox_ready.set()
+
+    return {"message": "Notification accepted"}
@@ -0,0 +1,186 @@
+"""Rebuild the Elasticsearch "videos" index from PostgreSQL.
+
+Streams every Video row in batches into a fresh versioned index (videos_vN) through
+parallel bulk workers, then atomically points the "videos" alias at it. Searches keep
+hitting the old index until the swap, so the rebuild needs no downtime. The outbox relay
+is paused for the whole rebuild: changes made meanwhile stay in the outbox and are applied
+to the new index once the alias points at it, instead of going to the old index and being
+lost with it.
+
+Usage (from the backend directory):
+    python reindex.py --batch-size 1000 --workers 4
+"""
+import argparse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from elasticsearch.helpers import async_bulk
+from sqlalchemy import select, text
+from sqlalchemy.orm import undefer_group
+
+from main2 import get_es, get_engine, close_clients, SessionLocal, Video, ES_INDEX_ALIAS, ES_RELAY_LOCK_KEY, VIDEOS_INDEX_MAPPING, video_document, versioned_index_name
+
+es = get_es()
+
+
+class Progress:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.indexed = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def add(self, indexed: int, failed: int):
+        self.indexed += indexed
+        self.failed += failed
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.indexed / elapsed if elapsed else 0.0
+        print(f"{self.indexed} docs indexed, {self.failed} failed, {rate:.0f} docs/sec")
+
+
+# Pick the next free videos_vN name
+async def next_index_name():
+    existing = await es.indices.get(index=f"{ES_INDEX_ALIAS}_v*", ignore_unavailable=True, allow_no_indices=True)
+    versions = []
+    for name in existing:
+        suffix = name[len(ES_INDEX_ALIAS) + 2:]
+        if suffix.isdigit():
+            versions.append(int(suffix))
+    return versioned_index_name(max(versions, default=0) + 1)
+
+
+# Indices the alias points at now, or a legacy concrete "videos" index
+async def current_indices():
+    if await es.indices.exists_alias(name=ES_INDEX_ALIAS):
+        return list((await es.indices.get_alias(name=ES_INDEX_ALIAS)).keys()), False
+    if await es.indices.exists(index=ES_INDEX_ALIAS):
+        return [ES_INDEX_ALIAS], True
+    return [], False
+
+
+async def current_replicas(indices: list, default: int = 1):
+    if not indices:
+        return default
+    settings = await es.indices.get_settings(index=indices[0], name="index.number_of_replicas")
+    return int(settings[indices[0]]["settings"]["index"]["number_of_replicas"])
+
+
+# Holds the relay's advisory lock. Taking it waits for a drain in progress, so every change is either
+# in the old index and the database snapshot, or still in the outbox.
+@asynccontextmanager
+async def relay_paused():
+    engine = get_engine()
+    if engine.dialect.name != "postgresql":
+        print("The outbox relay can only be paused on PostgreSQL; stop the API while reindexing so no update is lost.")
+        yield
+        return
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ES_RELAY_LOCK_KEY})
+        await conn.commit()
+        print("Outbox relay paused.")
+        try:
+            yield
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ES_RELAY_LOCK_KEY})
+            await conn.commit()
+            print("Outbox relay resumed.")
+
+
+# Server-side cursor over the table, one batch of documents at a time
+async def produce(queue: asyncio.Queue, batch_size: int, workers: int):
+    async with SessionLocal() as db:
+        result = await db.stream(
+            select(Video).options(undefer_group("details"), undefer_group("embedding")).order_by(Video.id).execution_options(yield_per=batch_size)
+        )
+        async for partition in result.scalars().partitions():
+            await queue.put([video_document(video) for video in partition])
+    for _ in range(workers):
+        await queue.put(None)
+
+
+async def consume(queue: asyncio.Queue, index_name: str, chunk_size: int, progress: Progress):
+    while True:
+        batch = await queue.get()
+        if batch is None:
+            return
+        actions = [{"_index": index_name, "_id": doc["video_id"], "_source": doc} for doc in batch]
+        indexed, failed = await async_bulk(es, actions, chunk_size=chunk_size, stats_only=True, raise_on_error=False)
+        progress.add(indexed, failed)
+
+
+async def reindex(batch_size: int, workers: int, chunk_size: int, keep_old: bool):
+    async with relay_paused():
+        swapped = await rebuild(batch_size, workers, chunk_size)
+    if swapped is None:
+        return
+    old_indices, legacy = swapped
+
+    if not keep_old and not legacy:
+        for old in old_indices:
+            await es.indices.delete(index=old)
+            print(f"Deleted old index '{old}'.")
+
+
+# Fill a new index and point the alias at it; returns the indices it replaced, or None if it didn't swap
+async def rebuild(batch_size: int, workers: int, chunk_size: int):
+    old_indices, legacy = await current_indices()
+    index_name = await next_index_name()
+
+    # Replicas and refreshes are switched off while loading and restored before the swap
+    await es.indices.create(index=index_name, body={
+        "mappings": VIDEOS_INDEX_MAPPING,
+        "settings": {"number_of_replicas": 0, "refresh_interval": "-1"}
+    })
+    print(f"Reindexing into '{index_name}' (currently serving: {', '.join(old_indices) or 'nothing'})")
+
+    progress = Progress(interval=5.0)
+    queue = asyncio.Queue(maxsize=workers * 2)
+    await asyncio.gather(
+        produce(queue, batch_size, workers),
+        *[consume(queue, index_name, chunk_size, progress) for _ in range(workers)]
+    )
+    progress.report()
+
+    if progress.failed:
+        print(f"{progress.failed} documents failed to index; leaving '{index_name}' in place without swapping the alias.")
+        return None
+
+    replicas = await current_replicas(old_indices)
+    await es.indices.put_settings(index=index_name, body={"index": {"number_of_replicas": replicas, "refresh_interval": "1s"}})
+    await es.indices.refresh(index=index_name)
+
+    # Swap the alias in one atomic call; a legacy concrete index has to be removed in the same call
+    actions = [{"add": {"index": index_name, "alias": ES_INDEX_ALIAS}}]
+    if legacy:
+        actions.append({"remove_index": {"index": ES_INDEX_ALIAS}})
+    else:
+        actions.extend({"remove": {"index": old, "alias": ES_INDEX_ALIAS}} for old in old_indices)
+    await es.indices.update_aliases(body={"actions": actions})
+    print(f"Alias '{ES_INDEX_ALIAS}' now points at '{index_name}'.")
+    return old_indices, legacy
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Rebuild the Elasticsearch videos index from PostgreSQL.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows fetched from the database per batch")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent bulk requests")
+    parser.add_argument("--chunk-size", type=int, default=500, help="documents per bulk request")
+    parser.add_argument("--keep-old", action="store_true", help="keep the previous index after the alias swap")
+    args = parser.parse_args()
+
+    try:
+        await reindex(args.batch_size, args.workers, args.chunk_size, args.keep_old)
+    finally:
+        await close_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
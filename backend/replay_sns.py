@@ -0,0 +1,135 @@
+"""Replay a burst of MediaConvert SNS notifications against a running API.
+
+Sends recorded SNS payloads (one JSON object per line) to /mediaconvert-callback as fast
+as the concurrency allows, reports how quickly they were acknowledged, then watches the
+database until every video carries its streaming_url. With --synthetic, payloads are
+generated for existing videos instead, and --duplicates resends a share of them with the
+same MessageId the way SNS redeliveries do.
+
+Usage (from the backend directory, with the API running against a local database):
+    python replay_sns.py --payloads recorded_sns.jsonl --concurrency 50
+    python replay_sns.py --synthetic 1000 --duplicates 0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import httpx
+from sqlalchemy import select
+
+from main2 import close_clients, SessionLocal, Video, streaming_update_from_notification
+
+
+def load_payloads(path: str):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_payload(video_id: str):
+    streaming_url = f"https://cdn.example.com/hls/{video_id}.m3u8"
+    return {
+        "Type": "Notification",
+        "MessageId": str(uuid.uuid4()),
+        "Message": json.dumps({"Outputs": {"HLS_GROUP": [streaming_url]}})
+    }
+
+
+async def synthetic_payloads(count: int, duplicates: float):
+    async with SessionLocal() as db:
+        video_ids = (await db.scalars(select(Video.video_id).order_by(Video.id.desc()).limit(count))).all()
+    payloads = [synthetic_payload(video_id) for video_id in video_ids]
+    payloads += random.sample(payloads, int(len(payloads) * duplicates))
+    random.shuffle(payloads)
+    return payloads
+
+
+async def send(client: httpx.AsyncClient, url: str, queue: asyncio.Queue, latencies: list, statuses: dict):
+    while True:
+        payload = await queue.get()
+        if payload is None:
+            return
+        started = time.monotonic()
+        response = await client.post(url, content=json.dumps(payload), headers={"Content-Type": "text/plain"})
+        latencies.append(time.monotonic() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+# Wait until the database reflects the last streaming_url sent for every video
+async def wait_for_updates(expected: dict, timeout: float):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        async with SessionLocal() as db:
+            rows = (await db.execute(
+                select(Video.video_id, Video.streaming_url).where(Video.video_id.in_(list(expected)))
+            )).all()
+        done = sum(1 for video_id, streaming_url in rows if streaming_url == expected[video_id])
+        if done == len(expected):
+            return time.monotonic() - started, done
+        await asyncio.sleep(0.2)
+    return None, done
+
+
+def percentile(values: list, fraction: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def replay(url: str, payloads: list, concurrency: int, timeout: float):
+    expected = {}
+    for payload in payloads:
+        if payload.get("Type") == "Notification":
+            parsed = streaming_update_from_notification(payload)
+            if parsed:
+                expected[parsed[0]] = parsed[1]
+
+    queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    for _ in range(concurrency):
+        queue.put_nowait(None)
+
+    latencies = []
+    statuses = {}
+    started = time.monotonic()
+    async with httpx.AsyncClient(timeout=30) as client:
+        await asyncio.gather(*[send(client, url, queue, latencies, statuses) for _ in range(concurrency)])
+    elapsed = time.monotonic() - started
+
+    print(f"Sent {len(payloads)} notifications for {len(expected)} videos in {elapsed:.2f}s ({len(payloads) / elapsed:.0f}/sec)")
+    print(f"Status codes: {statuses}")
+    if latencies:
+        print(f"Ack latency p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p99 {percentile(latencies, 0.99) * 1000:.1f}ms")
+
+    if expected:
+        settled, done = await wait_for_updates(expected, timeout)
+        if settled is None:
+            print(f"Only {done}/{len(expected)} videos updated after {timeout:.0f}s")
+        else:
+            print(f"All {done} videos updated {settled:.2f}s after the burst")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay a burst of MediaConvert SNS notifications.")
+    parser.add_argument("--url", default="http://localhost:8000/mediaconvert-callback", help="callback endpoint")
+    parser.add_argument("--payloads", help="file of recorded SNS payloads, one JSON object per line")
+    parser.add_argument("--synthetic", type=int, default=0, help="generate payloads for this many existing videos")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="share of synthetic payloads to redeliver")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent requests")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for the database to catch up")
+    args = parser.parse_args()
+
+    if not args.payloads and not args.synthetic:
+        parser.error("pass --payloads or --synthetic")
+
+    try:
+        payloads = load_payloads(args.payloads) if args.payloads else await synthetic_payloads(args.synthetic, args.duplicates)
+        await replay(args.url, payloads, args.concurrency, args.timeout)
+    finally:
+        await close_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -12,14 +12,22 @@ const HomePage = () => {
   const [searchQuery, setSearchQuery] = useState("");
   const [error, setError] = useState("");
   const [typingTimeout, setTypingTimeout] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchVideos();
   }, []);
 
-  const fetchVideos = () => {
-    fetch(`${API_URL}/videos`)
-      .then((response) => response.json())
+  // /videos returns one page at a time; X-Next-Cursor is set when there are older videos
+  const fetchVideos = (cursor = null) => {
+    const url = cursor ? `${API_URL}/videos?cursor=${cursor}` : `${API_URL}/videos`;
+    setLoadingMore(cursor !== null);
+    fetch(url)
+      .then((response) => {
+        setNextCursor(response.headers.get("X-Next-Cursor"));
+        return response.json();
+      })
       .then((data) => {
         if (Array.isArray(data) && data.length > 0) {
           const processedVideos = data.map((video) => ({
@@ -34,16 +42,25 @@ const HomePage = () => {
             transcription: video.transcription || null,
           }));
 
-          setVideos(processedVideos);
-        } else {
+          if (cursor) {
+            setVideos((previous) => [...previous, ...processedVideos]);
+          } else {
+            setVideos(processedVideos);
+          }
+        } else if (!cursor) {
           setError("No videos found. Displaying default videos.");
           setVideos(getDummyVideos());
         }
       })
       .catch(() => {
-        setError("Error fetching videos. Displaying default videos.");
-        setVideos(getDummyVideos());
-      });
+        if (cursor) {
+          setError("Error fetching more videos.");
+        } else {
+          setError("Error fetching videos. Displaying default videos.");
+          setVideos(getDummyVideos());
+        }
+      })
+      .finally(() => setLoadingMore(false));
   };
 
   const getDummyVideos = () => [
@@ -104,6 +121,7 @@ const HomePage = () => {
                 .then((videoDetails) => {
                   // Filter out any failed fetches (null values)
                   const validVideos = videoDetails.filter((video) => video !== null);
+                  setNextCursor(null);
                   setVideos(validVideos);
                 })
                 .catch(() => setError("Error fetching video details."));
@@ -116,6 +134,23 @@ const HomePage = () => {
     );
   };
 
+  // The list only carries the light fields, so load the full details when a video is opened
+  const handleSelectVideo = (video) => {
+    setSelectedVideo(video);
+    fetch(`${API_URL}/videos/${video.video_id}`)
+      .then((response) => (response.ok ? response.json() : null))
+      .then((details) => {
+        if (details) {
+          setSelectedVideo({
+            ...video,
+            ...details,
+            streaming_url: details.streaming_url || details.s3_url || video.streaming_url,
+          });
+        }
+      })
+      .catch(() => {});
+  };
+
   const handleUploadClick = () => {
     navigate("/upload");
   };
@@ -229,7 +264,7 @@ const HomePage = () => {
             <div
               key={video.video_id}
               className="video-item"
-              onClick={() => setSelectedVideo(video)}
+              onClick={() => handleSelectVideo(video)}
             >
               <ReactPlayer
                 url={video.streaming_url}
@@ -262,6 +297,16 @@ const HomePage = () => {
             )
           ))}
       </div>
+
+      {nextCursor && (
+        <button
+          className="load-more-button"
+          onClick={() => fetchVideos(nextCursor)}
+          disabled={loadingMore}
+        >
+          {loadingMore ? "Loading..." : "Load More"}
+        </button>
+      )}
     </div>
   );
 };